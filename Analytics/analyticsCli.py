@@ -0,0 +1,159 @@
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+
+from Analytics.resultStore import LocalObjectSource, ResultStore, S3ObjectSource
+
+# Time window -> numpy datetime unit
+Windows = {"day": "D", "week": "W", "month": "M"}
+
+
+def group_percentiles(values, keys, percentiles):
+    """
+    Compute percentiles of values per group, fully vectorised.
+
+    Args:
+        values (ndarray): The values, NaN values are ignored.
+        keys (list): One array per group-by column, same length as values.
+        percentiles (list): The percentiles to compute, 0-100.
+
+    Returns:
+        list: The distinct key tuples, one per group.
+        ndarray: The sample count per group.
+        ndarray: groups x percentiles, linearly interpolated like numpy.percentile.
+    """
+    valid = ~np.isnan(values)
+    values = values[valid]
+    keys = [np.asarray(key)[valid] for key in keys]
+    if values.size == 0:
+        return [], np.array([], dtype=np.int64), np.empty((0, len(percentiles)))
+
+    # One integer code per group from the codes of every key column
+    codes = np.zeros(values.size, dtype=np.int64)
+    uniques = []
+    for key in keys:
+        unique, inverse = np.unique(key, return_inverse=True)
+        codes = codes * len(unique) + inverse
+        uniques.append(unique)
+
+    # Sort by group, then by value, so each group is a sorted slice
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    group_codes, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+
+    positions = starts[:, None] + (counts[:, None] - 1) * (np.asarray(percentiles, dtype=np.float64)[None, :] / 100.0)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    result = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (positions - lower)
+
+    # Decode the group codes back into key tuples
+    group_keys = []
+    remaining = group_codes.copy()
+    columns = []
+    for unique in reversed(uniques):
+        columns.append(unique[remaining % len(unique)])
+        remaining //= len(unique)
+    for index in range(len(group_codes)):
+        group_keys.append(tuple(column[index] for column in reversed(columns)))
+
+    return group_keys, counts, result
+
+
+def window_labels(ts, window):
+    """
+    Label every epoch time with its day, week or month.
+    """
+    stamps = ts.astype("datetime64[s]")
+    return stamps.astype(f"datetime64[{Windows[window]}]").astype(str)
+
+
+def parse_date(value):
+    return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+def command_ingest(args):
+    store = ResultStore(args.store)
+    source = LocalObjectSource(args.local) if args.local else S3ObjectSource(args.bucket, args.prefix)
+    added = store.ingest(source)
+    print(f"Ingested {added} new runs")
+    if store.manifest["failed"]:
+        print(f"{len(store.manifest['failed'])} objects failed and are retried on the next ingest")
+
+
+def command_compact(args):
+    removed = ResultStore(args.store).compact()
+    print(f"Merged away {removed} part files")
+
+
+def command_percentiles(args):
+    store = ResultStore(args.store)
+    since = parse_date(args.since) if args.since else None
+    until = parse_date(args.until) if args.until else None
+    runs = store.load("runs", since=since, until=until)
+
+    mask = np.ones(runs["ts"].size, dtype=bool)
+    if since is not None:
+        mask &= runs["ts"] >= since
+    if until is not None:
+        mask &= runs["ts"] < until
+
+    if args.metric == "interval_mbps":
+        # Per-second samples, joined to the metadata of their run
+        intervals = store.load("intervals", since=since, until=until)
+        order = np.argsort(runs["run_id"])
+        rows = order[np.searchsorted(runs["run_id"], intervals["run_id"], sorter=order)]
+        keep = mask[rows]
+        values = intervals["mbps"][keep].astype(np.float64)
+        rows = rows[keep]
+    else:
+        values = runs[args.metric][mask]
+        rows = np.nonzero(mask)[0]
+
+    keys = [runs[column][rows] for column in args.group_by]
+    if args.window != "none":
+        keys.append(window_labels(runs["ts"][rows], args.window))
+
+    group_keys, counts, result = group_percentiles(values, keys, args.pct)
+
+    header = list(args.group_by) + ([args.window] if args.window != "none" else []) + ["n"] + [f"p{p:g}" for p in args.pct]
+    rows = [list(key) + [count] + [f"{value:.3f}" for value in values] for key, count, values in zip(group_keys, counts, result)]
+    print_table(header, rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and analyse LTE test results")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="fetch new result objects into the store")
+    ingest.add_argument("--store", required=True)
+    ingest.add_argument("--bucket", default="lte-performance-results")
+    ingest.add_argument("--prefix", default="")
+    ingest.add_argument("--local", help="read objects from this directory instead of S3")
+    ingest.set_defaults(handler=command_ingest)
+
+    compact = subparsers.add_parser("compact", help="merge the parts of every partition")
+    compact.add_argument("--store", required=True)
+    compact.set_defaults(handler=command_compact)
+
+    percentiles = subparsers.add_parser("percentiles", help="percentiles of a metric per group")
+    percentiles.add_argument("--store", required=True)
+    percentiles.add_argument("--metric", default="throughput_mbps",
+                             choices=["throughput_mbps", "interval_mbps", "rssi", "ooc_count", "latency_idle_p50_ms", "latency_loaded_p50_ms",
+                                      "in_coverage_mbps", "coverage_ratio"])
+    percentiles.add_argument("--pct", type=float, nargs="+", default=[10, 50, 90])
+    percentiles.add_argument("--group-by", nargs="*", default=["network"],
+                             choices=["network", "tac", "ci", "fw", "iccid", "imei"])
+    percentiles.add_argument("--window", default="none", choices=["none", "day", "week", "month"])
+    percentiles.add_argument("--since", help="YYYY-MM-DD")
+    percentiles.add_argument("--until", help="YYYY-MM-DD")
+    percentiles.set_defaults(handler=command_percentiles)
+
+    args = parser.parse_args()
+    args.handler(args)
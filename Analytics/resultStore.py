@@ -0,0 +1,324 @@
+import glob
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from Common.startupMetrics import timed_import
+from Common.units import to_mbps
+from Reporting.resultCodec import decode_result
+
+Module = "[ResultStore]"
+
+# Run table columns and their dtypes
+RunColumns = {
+    "run_id": np.int64,
+    "ts": np.int64,
+    "key": str,
+    "iccid": str,
+    "imsi": str,
+    "imei": str,
+    "fw": str,
+    "network": str,
+    "tac": str,
+    "ci": str,
+    "rssi": np.float64,
+    "throughput_mbps": np.float64,
+    "ooc_count": np.float64,
+    "latency_idle_p50_ms": np.float64,
+    "latency_loaded_p50_ms": np.float64,
+    "in_coverage_mbps": np.float64,
+    "coverage_ratio": np.float64,
+}
+
+# Interval table columns, one row per per-second throughput sample
+IntervalColumns = {
+    "run_id": np.int64,
+    "t": np.int32,
+    "mbps": np.float32,
+}
+
+
+class LocalObjectSource:
+    """
+    A local stand-in for the results bucket: every file below a directory is an object.
+
+    Args:
+        root (str): The directory holding the objects.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def list_keys(self):
+        keys = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                keys.append(os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/"))
+        return sorted(keys)
+
+    def get(self, key):
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+
+class S3ObjectSource:
+    """
+    The results bucket on S3.
+
+    Args:
+        bucket (str): The bucket name.
+        prefix (str): Only objects below this prefix. Defaults to "".
+    """
+    def __init__(self, bucket, prefix=""):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = timed_import("boto3").client("s3")
+
+    def list_keys(self):
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            keys += [item["Key"] for item in page.get("Contents", [])]
+        return sorted(keys)
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+
+def parse_cclk(value):
+    """
+    Convert an AT+CCLK time, e.g. '"24/03/15,10:20:30+04"', to epoch seconds.
+
+    Returns:
+        int: The UTC epoch time, None if the value can not be parsed.
+    """
+    match = re.search(r"(\d{2})/(\d{2})/(\d{2}),(\d{2}):(\d{2}):(\d{2})([+-]\d+)?", value or "")
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(group) for group in match.groups()[:6])
+    # The zone is given in quarters of an hour
+    quarters = int(match.group(7) or 0)
+    local = datetime(2000 + year, month, day, hour, minute, second, tzinfo=timezone.utc)
+    return int((local - timedelta(minutes=15 * quarters)).timestamp())
+
+
+def parse_result(document):
+    """
+    Flatten one result document into a run row and its interval series.
+
+    Args:
+        document (dict): The output_data document.
+
+    Returns:
+        dict: The run row, without run_id and key.
+        list: The per-second throughput samples in Mbit/s.
+
+    Raises:
+        ValueError: The document is not a result document.
+    """
+    if not isinstance(document, dict):
+        raise ValueError(f"Result document is a {type(document).__name__}, not an object")
+
+    def number(value):
+        return float(value) if isinstance(value, (int, float)) else np.nan
+
+    def p50(name):
+        latency = document.get(name) or {}
+        return number(latency.get("p50_ms"))
+
+    coverage = document.get("Coverage") or {}
+
+    throughput = np.nan
+    match = re.match(r"([\d.]+)\s+(\S+)", str(document.get("Throughput") or ""))
+    if match:
+        throughput = to_mbps(match.group(1), match.group(2))
+
+    row = {
+        "ts": parse_cclk(document.get("Test Time")) or 0,
+        "iccid": str(document.get("SIM ICCID") or ""),
+        "imsi": str(document.get("SIM IMSI") or ""),
+        "imei": str(document.get("IMEI") or ""),
+        "fw": str(document.get("FW Version") or "").strip(),
+        "network": str(document.get("Network") or "").strip('"'),
+        "tac": str(document.get("Network Tracking Area") or "").strip('"'),
+        "ci": str(document.get("Network Cell ID") or "").strip('"'),
+        "rssi": number(document.get("Signal Quality")),
+        "throughput_mbps": throughput,
+        "ooc_count": number(document.get("Out of Coverage Count")),
+        "latency_idle_p50_ms": p50("Latency Idle"),
+        "latency_loaded_p50_ms": p50("Latency Loaded"),
+        "in_coverage_mbps": number(coverage.get("in_coverage_mbps")),
+        "coverage_ratio": number(coverage.get("coverage_ratio")),
+    }
+    return row, list(document.get("Throughput Intervals") or [])
+
+
+def read_column(data, name, schema):
+    """
+    Read a column of a part, filling columns added after the part was written.
+    """
+    if name in data.files:
+        return data[name]
+    rows = len(data[data.files[0]])
+    if np.issubdtype(np.dtype(schema[name]), np.floating):
+        return np.full(rows, np.nan, dtype=schema[name])
+    return np.zeros(rows, dtype=schema[name])
+
+
+class ResultStore:
+    """
+    A columnar store of test results, partitioned by month.
+
+    Every ingest appends one NumPy .npz part per touched month under
+    runs/<YYYY-MM>/ and intervals/<YYYY-MM>/; compact() merges the parts of
+    each month into one. manifest.json records the ingested object keys, so
+    an ingest only fetches new objects, and the keys that failed to fetch or
+    decode, which the next ingest tries again.
+
+    Args:
+        root (str): The store directory.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.manifest = {"keys": [], "next_run_id": 0}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        # Key -> error of the objects that could not be ingested yet
+        self.manifest.setdefault("failed", {})
+
+    def save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def ingest(self, source):
+        """
+        Fetch and store the objects of the source not ingested yet.
+
+        Args:
+            source: LocalObjectSource or S3ObjectSource.
+
+        Returns:
+            int: The number of runs added.
+        """
+        known = set(self.manifest["keys"])
+        new_keys = [key for key in source.list_keys() if key not in known]
+
+        runs = {}
+        intervals = {}
+        for key in new_keys:
+            try:
+                # Encoded results, and plain JSON ones from before the codec
+                document = decode_result(source.get(key))
+                row, series = parse_result(document)
+            except (ValueError, TypeError, OSError, EOFError) as e:
+                print(f"{Module} Skipping {key} until the next ingest: {e}")
+                self.manifest["failed"][key] = str(e)
+                continue
+
+            self.manifest["failed"].pop(key, None)
+            row["run_id"] = self.manifest["next_run_id"]
+            row["key"] = key
+            self.manifest["next_run_id"] += 1
+            self.manifest["keys"].append(key)
+
+            partition = datetime.fromtimestamp(row["ts"], timezone.utc).strftime("%Y-%m")
+            runs.setdefault(partition, []).append(row)
+            if series:
+                intervals.setdefault(partition, []).append((row["run_id"], series))
+
+        for partition, rows in runs.items():
+            self._write_part("runs", partition, {
+                name: np.array([row[name] for row in rows], dtype=dtype) for name, dtype in RunColumns.items()
+            })
+        for partition, entries in intervals.items():
+            self._write_part("intervals", partition, {
+                "run_id": np.concatenate([np.full(len(series), run_id, dtype=np.int64) for run_id, series in entries]),
+                "t": np.concatenate([np.arange(len(series), dtype=np.int32) for _, series in entries]),
+                "mbps": np.concatenate([np.asarray(series, dtype=np.float32) for _, series in entries]),
+            })
+
+        # The manifest is written last, so no key is marked ingested before its data is stored
+        self.save_manifest()
+        return sum(len(rows) for rows in runs.values())
+
+    def _write_part(self, table, partition, columns):
+        directory = os.path.join(self.root, table, partition)
+        os.makedirs(directory, exist_ok=True)
+        number = len(glob.glob(os.path.join(directory, "part-*.npz")))
+        while os.path.exists(os.path.join(directory, f"part-{number:05d}.npz")):
+            number += 1
+        np.savez(os.path.join(directory, f"part-{number:05d}.npz"), **columns)
+
+    def _parts(self, table, since=None, until=None):
+        """
+        Get the part files of a table, pruned to the months overlapping [since, until).
+        """
+        first = datetime.fromtimestamp(since, timezone.utc).strftime("%Y-%m") if since is not None else None
+        last = datetime.fromtimestamp(until, timezone.utc).strftime("%Y-%m") if until is not None else None
+        parts = []
+        for directory in sorted(glob.glob(os.path.join(self.root, table, "*"))):
+            partition = os.path.basename(directory)
+            if (first and partition < first) or (last and partition > last):
+                continue
+            parts += sorted(glob.glob(os.path.join(directory, "part-*.npz")))
+        return parts
+
+    def load(self, table="runs", columns=None, since=None, until=None):
+        """
+        Load columns of a table.
+
+        Args:
+            table (str): "runs" or "intervals". Defaults to "runs".
+            columns (list): The columns to load. Defaults to all.
+            since (int): Only months from this epoch time on. Defaults to None.
+            until (int): Only months up to this epoch time. Defaults to None.
+
+        Returns:
+            dict: Column name -> NumPy array.
+        """
+        schema = RunColumns if table == "runs" else IntervalColumns
+        columns = columns or list(schema)
+        chunks = {name: [] for name in columns}
+        for part in self._parts(table, since, until):
+            with np.load(part) as data:
+                for name in columns:
+                    chunks[name].append(read_column(data, name, schema))
+
+        return {
+            name: np.concatenate(values) if values else np.array([], dtype=schema[name])
+            for name, values in chunks.items()
+        }
+
+    def compact(self):
+        """
+        Merge the parts of every partition into a single part.
+
+        Returns:
+            int: The number of part files removed.
+        """
+        removed = 0
+        for table, schema in (("runs", RunColumns), ("intervals", IntervalColumns)):
+            for directory in sorted(glob.glob(os.path.join(self.root, table, "*"))):
+                parts = sorted(glob.glob(os.path.join(directory, "part-*.npz")))
+                if len(parts) < 2:
+                    continue
+                merged = {}
+                for part in parts:
+                    with np.load(part) as data:
+                        for name in schema:
+                            merged.setdefault(name, []).append(read_column(data, name, schema))
+                tmp_path = os.path.join(directory, "compact.tmp.npz")
+                np.savez(tmp_path, **{name: np.concatenate(values) for name, values in merged.items()})
+                # The merged part replaces the first one before the others are removed
+                os.replace(tmp_path, parts[0])
+                for part in parts[1:]:
+                    os.remove(part)
+                removed += len(parts) - 1
+        return removed
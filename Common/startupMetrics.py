@@ -0,0 +1,41 @@
+import importlib
+import sys
+import time
+
+# Startup timings in seconds, e.g. {"imports_s": 0.12, "import_boto3_s": 1.8}
+StartupMetrics = {}
+
+
+def record_metric(name, start_time):
+    """
+    Record the time elapsed since start_time.
+
+    Args:
+        name (str): The metric name.
+        start_time (float): A time.perf_counter() value.
+
+    Returns:
+        float: The elapsed time in seconds.
+    """
+    elapsed = time.perf_counter() - start_time
+    StartupMetrics[name] = round(elapsed, 4)
+    return elapsed
+
+
+def timed_import(name):
+    """
+    Import a module on first use and record how long the import took.
+
+    Args:
+        name (str): The module name, e.g. "boto3".
+
+    Returns:
+        module: The imported module.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    start_time = time.perf_counter()
+    module = importlib.import_module(name)
+    record_metric(f"import_{name}_s", start_time)
+    return module
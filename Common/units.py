@@ -0,0 +1,13 @@
+def to_mbps(value, unit):
+    """
+    This method converts an iperf rate to Mbit/s
+
+    Args:
+        value (str): The rate value, e.g. "9.42"
+        unit (str): The rate unit, e.g. "Mbits/sec"
+
+    Returns:
+        float: The rate in Mbit/s.
+    """
+    scale = {"K": 1e-3, "M": 1.0, "G": 1e3}
+    return float(value) * scale.get(unit[:1], 1e-6)
@@ -0,0 +1,304 @@
+import json
+import re
+import threading
+import time
+from serialCOM.at_scheduler import PRIORITY_CONTROL
+from serialCOM.dut_communication import parse_cereg
+from DataCommunication.dataOverDialup import run_link_profile
+
+Module = "[BandMatrix]"
+
+# Path of a JSON matrix file. When set, the band matrix runs instead of the single test
+BandMatrixEnv = "TESTBENCH_BAND_MATRIX"
+
+# AT+QCFG="nwscanmode" values
+ScanModes = {"auto": 0, "gsm": 1, "umts": 2, "lte": 3}
+
+# Entries of the default matrix. "lte_bands" locks the LTE bands, without it
+# the band configuration found at the start is used
+DefaultMatrix = [
+    {"name": "auto", "rat": "auto"},
+    {"name": "B3", "rat": "lte", "lte_bands": [3]},
+    {"name": "B7", "rat": "lte", "lte_bands": [7]},
+    {"name": "B20", "rat": "lte", "lte_bands": [20]},
+]
+
+# iperf duration of one matrix entry in seconds
+MatrixIperfDuration = 60
+
+# Seconds between fallback AT+CEREG? queries while no URC arrives
+RegistrationQueryInterval = 3
+
+# Columns of the printed band x metric table
+TableColumns = ["entry", "serving_band", "act", "rssi", "registration_s", "throughput_mbps",
+                "latency_idle_p50_ms", "latency_loaded_p50_ms", "latency_loaded_p95_ms", "loss_pct"]
+
+
+def load_matrix(path):
+    """
+    Load a matrix from a JSON file holding a list of entries like DefaultMatrix.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        if entry.get("rat", "auto") not in ScanModes:
+            raise ValueError(f"Unknown RAT {entry['rat']!r} in {entry.get('name')}")
+    return entries
+
+
+def lte_band_mask(bands):
+    """
+    Convert LTE band numbers to the <ltebandval> of AT+QCFG="band", e.g. [1, 3] -> "0x5".
+    """
+    mask = 0
+    for band in bands:
+        mask |= 1 << (int(band) - 1)
+    return hex(mask)
+
+
+def parse_qcfg(response, name):
+    """
+    Parse the values of an AT+QCFG read, e.g. '+QCFG: "band",0x260,0x1a,0x0' -> ["0x260", "0x1a", "0x0"].
+
+    Returns:
+        list: The values, None if the response does not carry the setting.
+    """
+    match = re.search(rf'\+QCFG: "{name}",([^\r\n]+)', response)
+    if not match:
+        return None
+    return [value.strip() for value in match.group(1).split(",")]
+
+
+def parse_qnwinfo(response):
+    """
+    Parse AT+QNWINFO, e.g. '+QNWINFO: "FDD LTE","24001","LTE BAND 3",1300'.
+
+    Returns:
+        tuple: (act, band) as reported, e.g. ("FDD LTE", "LTE BAND 3"). None if not found.
+    """
+    match = re.search(r'\+QNWINFO: "([^"]*)","[^"]*","([^"]*)"', response)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def same_config(a, b):
+    """
+    Compare two configurations from read_config(), the values are hexadecimal or decimal numbers.
+    """
+    return all([int(v, 16) for v in a[name]] == [int(v, 16) for v in b[name]] for name in ("band", "nwscanmode"))
+
+
+def format_table(rows, columns=TableColumns):
+    """
+    Format the matrix results as a text table, one row per entry.
+    """
+    cells = [["-" if row.get(column) is None else str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(cell) for cell in column) for column in zip(columns, *cells)]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)) for line in [columns] + cells)
+
+
+class BandMatrixRunner:
+    """
+    Sweeps band locks and RAT preferences on the DUT and profiles each of them.
+
+    The runner shares the live AT session through a scheduler client, so no
+    port is reopened between entries. Only settings that differ from the
+    current ones are written, and re-registration is detected from +CEREG
+    URCs (AT+CEREG? is only a fallback), confirmed with AT+QNWINFO when a
+    band is locked. The configuration found at the start is restored at the end.
+
+    Args:
+        InstrumentData: the instrument data
+        scheduler (ATCommandScheduler): The scheduler owning the AT port.
+        profile (callable): Called with the entry once registered, returns a dict of metrics.
+            Defaults to dial-up, latency and iperf for MatrixIperfDuration seconds.
+        registration_timeout (float): Seconds to wait for registration per entry. Defaults to 90.
+    """
+    def __init__(self, InstrumentData, scheduler, profile=None, registration_timeout=90):
+        self.InstrumentData = InstrumentData
+        self.scheduler = scheduler
+        self.at = scheduler.client("BandMatrix", PRIORITY_CONTROL)
+        self.profile = profile or (lambda entry: run_link_profile(InstrumentData, MatrixIperfDuration))
+        self.registration_timeout = registration_timeout
+        self.current = None
+        self.reg_stat = -1
+        self.act = -1
+        self.changed = threading.Event()
+
+    def on_cereg(self, line):
+        cereg = parse_cereg(line)
+        if cereg is not None:
+            self.reg_stat, _, _, self.act = cereg
+            self.changed.set()
+
+    def read_config(self):
+        """
+        Read the band and scan mode configuration.
+
+        Returns:
+            dict: {"band": [...], "nwscanmode": [...]} with the values as read.
+        """
+        config = {}
+        for name in ("band", "nwscanmode"):
+            errorCode, response = self.at.send_command_and_read_response(f'AT+QCFG="{name}"\r\n', "")
+            config[name] = parse_qcfg(response, name)
+            if config[name] is None:
+                raise RuntimeError(f"AT+QCFG=\"{name}\" not supported: {response!r}")
+        return config
+
+    def target_config(self, entry, original):
+        """
+        Get the configuration of a matrix entry.
+        """
+        band = list(original["band"])
+        if entry.get("lte_bands"):
+            band[1] = lte_band_mask(entry["lte_bands"])
+        scan_mode = [str(ScanModes[entry.get("rat", "auto")])] + original["nwscanmode"][1:]
+        return {"band": band, "nwscanmode": scan_mode}
+
+    def apply(self, config):
+        """
+        Write the settings that differ from the current configuration.
+
+        Only settings the modem accepted are taken as current, so a failed
+        write is tried again by the next apply().
+
+        Returns:
+            bool: True if anything was written, so the modem re-registers.
+        """
+        written = False
+        for name in ("nwscanmode", "band"):
+            if [int(v, 16) for v in self.current[name]] == [int(v, 16) for v in config[name]]:
+                continue
+            # The trailing 1 applies the setting immediately
+            command = f'AT+QCFG="{name}",{",".join(config[name])},1\r\n'
+            errorCode, response = self.at.send_command_and_read_response(command, "", timeout=10)
+            if errorCode != 0 or "OK" not in response:
+                print(f"{Module} {command.strip()} failed: {response.strip()}")
+                continue
+            self.current[name] = list(config[name])
+            written = True
+        return written
+
+    def restore(self, original):
+        """
+        Restore the original configuration and confirm it by reading it back.
+
+        Returns:
+            bool: True if the modem reports the original configuration again.
+        """
+        for attempt in range(2):
+            if self.apply(original):
+                self.reg_stat = -1
+            self.wait_registered({})
+            try:
+                # The modem is the reference, also for the next attempt
+                self.current = self.read_config()
+            except RuntimeError as e:
+                print(f"{Module} Unable to read back the configuration: {e}")
+                return False
+            if same_config(self.current, original):
+                print(f"{Module} Restored configuration: {original}")
+                return True
+        print(f"{Module} Configuration not restored, the modem reports {self.current} instead of {original}")
+        return False
+
+    def serving_band(self):
+        errorCode, response = self.at.send_command_and_read_response("AT+QNWINFO\r\n", "")
+        return parse_qnwinfo(response)
+
+    def wait_registered(self, entry):
+        """
+        Wait until the modem is registered, on one of the locked bands if any.
+
+        Returns:
+            tuple: (act, band) from AT+QNWINFO, None on timeout.
+        """
+        deadline = time.monotonic() + self.registration_timeout
+        while time.monotonic() < deadline and self.InstrumentData.get("CloseAllThread") != "yes":
+            self.changed.clear()
+            if self.reg_stat in (1, 5):
+                serving = self.serving_band()
+                bands = entry.get("lte_bands")
+                if serving is not None and (not bands or any(re.search(rf"\b{band}$", serving[1]) for band in bands)):
+                    return serving
+
+            if not self.changed.wait(min(RegistrationQueryInterval, max(0, deadline - time.monotonic()))):
+                self.query_registration()
+        return None
+
+    def query_registration(self):
+        errorCode, response = self.at.send_command_and_read_response("AT+CEREG?\r\n", "")
+        cereg = parse_cereg(response, query=True)
+        if cereg is not None:
+            self.reg_stat, _, _, self.act = cereg
+
+    def rssi(self):
+        errorCode, response = self.at.send_command_and_read_response("AT+CSQ\r\n", "")
+        match = re.search(r"\+CSQ: (\d+),(\d+)", response)
+        return int(match.group(1)) if match else None
+
+    def run(self, entries):
+        """
+        Profile every entry and restore the original configuration.
+
+        Args:
+            entries (list): The matrix entries, see DefaultMatrix.
+
+        Returns:
+            list: One result row per entry, see TableColumns.
+        """
+        original = self.read_config()
+        self.current = {name: list(values) for name, values in original.items()}
+        print(f"{Module} Original configuration: {original}")
+
+        self.scheduler.subscribe_urc("+CEREG", self.on_cereg)
+        self.query_registration()
+        rows = []
+        try:
+            for entry in entries:
+                if self.InstrumentData.get("CloseAllThread") == "yes":
+                    break
+                name = entry.get("name", str(len(rows)))
+                self.InstrumentData["Running_Task"] = f"Band matrix: {name}"
+                row = {"entry": name, "rat": entry.get("rat", "auto"), "lte_bands": entry.get("lte_bands")}
+
+                start_time = time.monotonic()
+                if self.apply(self.target_config(entry, original)):
+                    # The modem only reports the re-registration if it dropped out first
+                    self.reg_stat = -1
+                serving = self.wait_registered(entry)
+                row["registration_s"] = round(time.monotonic() - start_time, 2)
+                if serving is None:
+                    print(f"{Module} {name}: not registered within {self.registration_timeout} s")
+                    rows.append(row)
+                    continue
+
+                row["act"], row["serving_band"] = serving
+                row["cereg_act"] = self.act
+                row["rssi"] = self.rssi()
+                print(f"{Module} {name}: registered on {serving} in {row['registration_s']} s")
+                row.update(self.profile(entry) or {})
+                rows.append(row)
+        finally:
+            self.restore(original)
+            self.scheduler.unsubscribe_urc("+CEREG", self.on_cereg)
+
+        return rows
+
+
+def bandMatrixTask(InstrumentData, scheduler, entries):
+    """
+    This method runs the band matrix and stores its results in InstrumentData["Band_Matrix"]
+
+    Args:
+        InstrumentData: the instrument data
+        scheduler (ATCommandScheduler): The scheduler owning the AT port.
+        entries (list): The matrix entries, see DefaultMatrix.
+
+    Returns:
+        None
+    """
+    print(f"{Module} Running {len(entries)} matrix entries")
+    InstrumentData["Band_Matrix"] = BandMatrixRunner(InstrumentData, scheduler).run(entries)
+    InstrumentData["Running_Task"] = "Test Completed"
+    print(f"{Module} Results:\n{format_table(InstrumentData['Band_Matrix'])}")
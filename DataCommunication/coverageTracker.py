@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+
+Module = "[Coverage]"
+
+# +CEREG <stat> values that count as in coverage (home, roaming)
+InCoverageStates = (1, 5)
+
+
+class CoverageTracker:
+    """
+    Follows the registration state during a test and accounts every
+    throughput sample to in-coverage or out-of-coverage time.
+
+    Registration changes arrive as (time.monotonic(), stat) tuples on the
+    queue the URC loop publishes to. A sample is out of coverage if an
+    outage overlapped its interval. With suspend set, the running iperf
+    process is terminated when coverage is lost, and wait_in_coverage()
+    blocks the caller until the modem has registered again.
+
+    Args:
+        events (queue.Queue): The registration events.
+        suspend (bool): Stop iperf while out of coverage. Defaults to False.
+    """
+    def __init__(self, events, suspend=False):
+        self.events = events
+        self.suspend = suspend
+        self.start_time = time.monotonic()
+        self.outages = []
+        self.samples = []
+        self.process = None
+        self.lock = threading.Lock()
+        self.in_coverage = threading.Event()
+        self.in_coverage.set()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start following the registration events in a background thread.
+        """
+        # Events from before the test are stale
+        while not self.events.empty():
+            self.events.get_nowait()
+        self.start_time = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop following the registration events.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                t, stat = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.update(t, stat)
+
+    def update(self, t, stat):
+        """
+        Apply one registration change.
+
+        Args:
+            t (float): The time.monotonic() of the change.
+            stat (int): The +CEREG <stat>.
+        """
+        with self.lock:
+            if stat in InCoverageStates and not self.in_coverage.is_set():
+                self.outages[-1]["end"] = t
+                print(f"{Module} Back in coverage after {t - self.outages[-1]['start']:.1f} s")
+                self.in_coverage.set()
+            elif stat not in InCoverageStates and self.in_coverage.is_set():
+                self.outages.append({"start": t, "end": None})
+                print(f"{Module} Out of coverage (stat {stat})")
+                self.in_coverage.clear()
+                if self.suspend and self.process is not None and self.process.poll() is None:
+                    print(f"{Module} Suspending iperf")
+                    self.process.terminate()
+
+    def attach(self, process):
+        """
+        Set the iperf process to suspend on an outage.
+        """
+        with self.lock:
+            self.process = process
+            if self.suspend and not self.in_coverage.is_set():
+                process.terminate()
+
+    def wait_in_coverage(self, timeout=None):
+        """
+        Wait until the modem is registered.
+
+        Returns:
+            bool: True if in coverage.
+        """
+        return self.in_coverage.wait(timeout)
+
+    def covered(self, start, end):
+        """
+        Check that no outage overlapped [start, end].
+        """
+        with self.lock:
+            for outage in self.outages:
+                if outage["start"] <= end and (outage["end"] is None or outage["end"] >= start):
+                    return False
+        return True
+
+    def record(self, duration, mbps):
+        """
+        Record a throughput sample that just ended.
+
+        Args:
+            duration (float): The length of the sample interval in seconds.
+            mbps (float): The throughput in Mbit/s.
+
+        Returns:
+            bool: True if the sample was in coverage.
+        """
+        now = time.monotonic()
+        covered = self.covered(now - duration, now)
+        self.samples.append((now, duration, mbps, covered))
+        return covered
+
+    def summary(self, end_time=None):
+        """
+        Summarise the coverage and the throughput split by coverage.
+
+        Returns:
+            dict: The raw and in-coverage mean throughput, the coverage ratio and
+                per outage its start, length and the time from re-registration
+                until data flowed again.
+        """
+        end_time = end_time or time.monotonic()
+        span = max(end_time - self.start_time, 1e-6)
+
+        def mean(samples):
+            duration = sum(sample[1] for sample in samples)
+            return round(sum(sample[1] * sample[2] for sample in samples) / duration, 3) if duration else None
+
+        outages = []
+        ooc_time = 0.0
+        with self.lock:
+            for outage in self.outages:
+                end = outage["end"] if outage["end"] is not None else end_time
+                ooc_time += end - outage["start"]
+                recover = None
+                if outage["end"] is not None:
+                    after = [sample[0] for sample in self.samples if sample[0] > outage["end"] and sample[2] > 0 and sample[3]]
+                    recover = round(after[0] - outage["end"], 2) if after else None
+                outages.append({
+                    "start_s": round(outage["start"] - self.start_time, 2),
+                    "ooc_s": round(end - outage["start"], 2),
+                    "recover_s": recover,
+                })
+
+        return {
+            "raw_mean_mbps": mean(self.samples),
+            "in_coverage_mbps": mean([sample for sample in self.samples if sample[3]]),
+            "coverage_ratio": round(max(0.0, 1 - ooc_time / span), 4),
+            "outage_count": len(outages),
+            "outages": outages,
+            "suspended": self.suspend,
+        }
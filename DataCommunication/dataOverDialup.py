@@ -1,7 +1,41 @@
+import os
 import sys
 import subprocess
 import re
+import threading
 import time
+from Common.units import to_mbps
+from DataCommunication.latencyProbe import LatencyProbe
+from DataCommunication.ifaceSampler import InterfaceCounterSampler
+from Monitoring.resourceMonitor import ResourceMonitor
+from DataCommunication.coverageTracker import CoverageTracker
+
+# iperf server used for the throughput test
+IperfServer = '209.58.159.68'
+IperfPorts = '5201-5210'
+IperfDuration = 600
+
+# Servers of the multi-server aggregate test, "host" or "host:ports". With more than
+# one server, coordinated clients run against all of them instead of the single test
+IperfServers = [f"{IperfServer}:{IperfPorts}"]
+
+# Latency probe settings. Method is "icmp", "udp" or "tcp" (the last two need an echo service on LatencyPort)
+LatencyTarget = IperfServer
+LatencyMethod = "icmp"
+LatencyPort = 7
+LatencyInterval = 0.2
+LatencyBaselineCount = 50
+
+# Serialises bringing the PPP link up and down (dialup task and watchdog)
+LinkLock = threading.Lock()
+
+# Interface byte-counter sampling rate
+InterfaceSampleRate = 10
+
+# Stop iperf while out of coverage and resume it once registered and the link is up
+SuspendOnOutage = False
+# Longest a suspended test waits for coverage, in seconds. It then ends with the samples so far
+MaxSuspendTime = 1800
 
 def execute_command(command):
     """
@@ -21,6 +55,101 @@ def execute_command(command):
     return output
 
 
+def parse_iperf_interval(line):
+    """
+    This method parses a per-interval line of iperf3 text output
+
+    Args:
+        line (str): One line of iperf3 output.
+
+    Returns:
+        tuple: (start, end, Mbit/s) of the interval, None if the line is not an interval report.
+    """
+    match = re.search(r"^\[\s*\d+\]\s+([\d.]+)-([\d.]+)\s+sec\s+\S+\s+\S*Bytes\s+([\d.]+)\s+(\S*bits/sec)(.*)$", line)
+    if not match or "sender" in match.group(5) or "receiver" in match.group(5):
+        return None
+
+    return float(match.group(1)), float(match.group(2)), to_mbps(match.group(3), match.group(4))
+
+
+def parse_iperf_result(output):
+    """
+    This method parses the receiver summary of iperf3 text output
+
+    Args:
+        output (str): The iperf3 output.
+
+    Returns:
+        str: The transfer rate, e.g. "9.42 Mbits/sec". None if there is no summary.
+    """
+    matches = re.findall(r"([\d.]+) (\S*bits/sec).*receiver", output)
+    if not matches:
+        return None
+
+    value, unit = matches[-1]
+    return f"{value} {unit}"
+
+
+def publish_sample(InstrumentData, mbps):
+    """
+    This method publishes a per-second iperf sample for the live view and the watchdog
+
+    Args:
+        InstrumentData: the instrument data
+        mbps (float): The sample in Mbit/s.
+
+    Returns:
+        None
+    """
+    seq = InstrumentData["Throughput_Sample"][0] + 1 if "Throughput_Sample" in InstrumentData else 0
+    InstrumentData["Throughput_Sample"] = (seq, mbps)
+    InstrumentData.setdefault("Throughput_Intervals", []).append(round(mbps, 3))
+
+
+def publish_iperf_run(InstrumentData, process):
+    """
+    This method publishes a started iperf run for the watchdog
+
+    Args:
+        InstrumentData: the instrument data
+        process: The iperf process, anything with poll() like Popen.
+
+    Returns:
+        None
+    """
+    seq = InstrumentData["Iperf_Run"][0] + 1 if "Iperf_Run" in InstrumentData else 0
+    InstrumentData["Iperf_Run"] = (seq, process)
+
+
+def run_iperf(command, on_interval=None, on_start=None):
+    """
+    This method executes iperf and reports every interval while it is running
+
+    Args:
+        command (str): The iperf command to execute.
+        on_interval (callable): Called with (start, end, Mbit/s) for every interval line. Defaults to None.
+        on_start (callable): Called with the iperf process, e.g. to terminate it early. Defaults to None.
+
+    Returns:
+        bytes: The output of the command.
+    """
+    # exec, so terminating the process stops iperf and not just the shell
+    process = subprocess.Popen(f"exec {command}", stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    if on_start is not None:
+        on_start(process)
+
+    output = b""
+    for line in process.stdout:
+        output += line
+        if on_interval is not None:
+            interval = parse_iperf_interval(line.decode(errors="replace"))
+            if interval:
+                on_interval(*interval)
+
+    process.communicate()
+    return output
+
+
 def find_ip_address(text):
     """
     This method finds the IP address from response of "ifconfig <interface>"
@@ -47,9 +176,83 @@ def find_ip_address(text):
         return None
         
 
-def dialupTask(InstrumentData, DialupComport, messagesQueue):
+def setup_link(dialup_port=None):
     """
-    This method is the main dialup task
+    This method brings up the PPP link and routes the test traffic over it
+
+    Args:
+        dialup_port (str): The PPP tty, e.g. "/dev/ttyUSB3". Defaults to the tty of the MyProvider peers file.
+
+    Returns:
+        bool: False if the dialup connection failed.
+        str: The IP address of ppp0.
+    """
+    with LinkLock:
+        # Initiate the dialup connection
+        # pppd takes a tty given after the peer name over the one in the peers file,
+        # so the link follows the modem when it re-enumerates on another port
+        print(f"[DialUp-Task]  Initiating Dialup Connection on {dialup_port or 'the peers file tty'}")
+        response = execute_command(f"sudo pon MyProvider {dialup_port}" if dialup_port else "sudo pon MyProvider")
+        print(response.decode())
+
+        # Wait for three Seconds
+        print("[DialUp-Task]  Waiting for 3 seconds")
+        time.sleep(3)
+
+        # Check if the connection is successful
+        response = execute_command("plog")
+        print(response.decode())
+        match = re.search(r"Connection terminated", response.decode())
+        if match:
+            print("[DialUp-Task]  Dialup Connection Failed")
+            return False, None
+        else:
+            print("[DialUp-Task]  Dialup Connection Successful")
+
+        # Check PPP connection in the system
+        response = execute_command("ifconfig")
+        print(response.decode())
+        match = re.search(r"ppp0", response.decode())
+        if match:
+            print("[DialUp-Task]  PPP Connection Successful")
+        else:
+            print("[DialUp-Task]  PPP Connection Failed")
+
+        # Check the IP address
+        response = execute_command("ifconfig ppp0")
+        print(response.decode())
+        ip_address = find_ip_address(response.decode())
+        print(f"[DialUp-Task]  IP Address: {ip_address}")
+
+        # Add static route for iperf server
+        print("[DialUp-Task]  Adding static route for iperf server")
+        print(f"[DialUp-Task]  sudo ip route add {IperfServer}/32 via {ip_address}")
+        response = execute_command(f"sudo ip route add {IperfServer}/32 via {ip_address}")
+        print(response.decode())
+
+        # Add static routes for the other servers of the multi-server test
+        for host in sorted({server.rpartition(":")[0] or server for server in IperfServers} - {IperfServer}):
+            print(f"[DialUp-Task]  Adding static route for iperf server {host}")
+            response = execute_command(f"sudo ip route add {host}/32 via {ip_address}")
+            print(response.decode())
+
+        # Add static route for latency target
+        if LatencyTarget != IperfServer:
+            print("[DialUp-Task]  Adding static route for latency target")
+            response = execute_command(f"sudo ip route add {LatencyTarget}/32 via {ip_address}")
+            print(response.decode())
+
+        # Check the route
+        print("[DialUp-Task]  Checking the route")
+        response = execute_command("ip route")
+        print(response.decode())
+
+    return True, ip_address
+
+
+def teardown_link():
+    """
+    This method terminates the PPP link
 
     Args:
         None
@@ -57,87 +260,239 @@ def dialupTask(InstrumentData, DialupComport, messagesQueue):
     Returns:
         None
     """
+    with LinkLock:
+        print("[DialUp-Task]  Terminating Dialup Connection")
+        response = execute_command("sudo poff MyProvider")
+        print(response.decode())
 
-    print("[DialUp-Task] Dialup Task Started")
 
-    # Initiate the dialup connection
-    print("[DialUp-Task]  Initiating Dialup Connection")
-    response = execute_command("sudo pon MyProvider")
-    print(response.decode())
+def redial_link(InstrumentData):
+    """
+    This method re-establishes the PPP link, e.g. after it dropped
 
-    # Wait for three Seconds
-    print("[DialUp-Task]  Waiting for 3 seconds")
-    time.sleep(3)
+    Args:
+        InstrumentData: the instrument data
 
-    # Check if the connection is successful
-    response = execute_command("plog")
-    print(response.decode())
-    match = re.search(r"Connection terminated", response.decode())
-    if match:
-        print("[DialUp-Task]  Dialup Connection Failed")
+    Returns:
+        bool: True if ppp0 is up again.
+    """
+    teardown_link()
+    # pppd needs a moment to release the tty
+    time.sleep(1)
+    connected, ip_address = setup_link(InstrumentData.get("Dialup_Port"))
+    InstrumentData["PPP_IP"] = ip_address
+    return connected and ip_address is not None
+
+
+def run_link_profile(InstrumentData, duration):
+    """
+    This method dials up, measures idle latency, then throughput and loaded latency, and hangs up
+
+    Args:
+        InstrumentData: the instrument data
+        duration (int): The iperf duration in seconds.
+
+    Returns:
+        dict: throughput_mbps, its per-second throughput_intervals, latency and loss figures.
+            None if the link did not come up.
+    """
+    connected, ip_address = setup_link(InstrumentData.get("Dialup_Port"))
+    if not connected or ip_address is None:
+        teardown_link()
+        return None
+    InstrumentData["PPP_IP"] = ip_address
+    InstrumentData["Link_Expected"] = True
+
+    try:
+        latencyProbe = LatencyProbe(LatencyTarget, method=LatencyMethod, port=LatencyPort, interface="ppp0",
+                                    source_address=ip_address, interval=LatencyInterval)
+        idle = latencyProbe.run_baseline(LatencyBaselineCount).summary()
+
+        latencyProbe.start()
+        InstrumentData["Running_Task"] = "Running iperf data transfer"
+        # The series of this profile only, a sweep keeps one per entry
+        InstrumentData["Throughput_Intervals"] = []
+        response = run_iperf(f"iperf3 -c {IperfServer} -p {IperfPorts} -t {duration}secs --forceflush",
+                             lambda start, end, mbps: publish_sample(InstrumentData, mbps),
+                             on_start=lambda process: publish_iperf_run(InstrumentData, process))
+        loaded = latencyProbe.stop().summary()
+    finally:
+        InstrumentData["Link_Expected"] = False
+        teardown_link()
+
+    transferRate = parse_iperf_result(response.decode())
+    return {
+        "throughput_mbps": round(to_mbps(*transferRate.split()), 3) if transferRate else None,
+        "throughput_intervals": InstrumentData.pop("Throughput_Intervals", []),
+        "latency_idle_p50_ms": idle["p50_ms"],
+        "latency_loaded_p50_ms": loaded["p50_ms"],
+        "latency_loaded_p95_ms": loaded["p95_ms"],
+        "loss_pct": loaded["loss_pct"],
+    }
+
+
+def dialupTask(InstrumentData, DialupComport, messagesQueue):
+    """
+    This method is the main dialup task
+
+    Args:
+        InstrumentData: the instrument data
+        DialupComport (str): The PPP tty, used until discovery reports one in InstrumentData["Dialup_Port"]
+        messagesQueue: the message queues
+
+    Returns:
+        None
+    """
+
+    print("[DialUp-Task] Dialup Task Started")
+
+    # Bring up the PPP link
+    InstrumentData.setdefault("Dialup_Port", DialupComport)
+    connected, ip_address = setup_link(InstrumentData["Dialup_Port"])
+    if not connected:
         return
-    else:
-        print("[DialUp-Task]  Dialup Connection Successful")
+    InstrumentData["PPP_IP"] = ip_address
+    InstrumentData["Link_Expected"] = True
 
-    # Check PPP connection in the system
-    response = execute_command("ifconfig")
-    print(response.decode())
-    match = re.search(r"ppp0", response.decode())
-    if match:
-        print("[DialUp-Task]  PPP Connection Successful")
-    else:
-        print("[DialUp-Task]  PPP Connection Failed")
+    # Sample the interface counters for the whole session
+    ifaceSampler = InterfaceCounterSampler("ppp0", rate_hz=InterfaceSampleRate,
+                                           capacity=int((IperfDuration + 300) * InterfaceSampleRate))
+    ifaceSampler.start()
 
-    # Check the IP address
-    response = execute_command("ifconfig ppp0")
-    print(response.decode())
-    ip_address = find_ip_address(response.decode())
-    print(f"[DialUp-Task]  IP Address: {ip_address}")
+    # Watch the load of the bench itself, a saturated or throttled Pi limits the result
+    resourceMonitor = ResourceMonitor(capacity=IperfDuration + 300)
+    resourceMonitor.start()
 
-    # Add static route for iperf server
-    print("[DialUp-Task]  Adding static route for iperf server")
-    print(f"[DialUp-Task]  sudo ip route add 209.58.159.68/32 via {ip_address}")
-    response = execute_command(f"sudo ip route add 209.58.159.68/32 via {ip_address}")
-    print(response.decode())
+    # Measure the idle latency before loading the link
+    InstrumentData["Running_Task"] = "Measuring idle latency"
+    latencyProbe = LatencyProbe(LatencyTarget, method=LatencyMethod, port=LatencyPort, interface="ppp0",
+                                source_address=ip_address, interval=LatencyInterval)
+    print(f"[DialUp-Task]  Measuring idle latency to {LatencyTarget} ({LatencyMethod})")
+    InstrumentData["Latency_Idle"] = latencyProbe.run_baseline(LatencyBaselineCount).summary()
+    print(f"[DialUp-Task]  Idle latency: {InstrumentData['Latency_Idle']}")
 
-    # Check the route
-    print("[DialUp-Task]  Checking the route")
-    response = execute_command("ip route")
-    print(response.decode())
+    # Keep probing while iperf loads the link
+    latencyProbe.start()
 
+    # Publish every per-second sample for the live view and keep the series for the result,
+    # each sample tagged with whether it was in coverage
+    InstrumentData["Throughput_Intervals"] = []
+    InstrumentData["Throughput_Coverage"] = []
+    coverage = CoverageTracker(messagesQueue['Registration'], suspend=SuspendOnOutage)
+    coverage.start()
+    def on_interval(start, end, mbps):
+        publish_sample(InstrumentData, mbps)
+        InstrumentData["Throughput_Coverage"].append(int(coverage.record(end - start, mbps)))
+    def on_start(process):
+        publish_iperf_run(InstrumentData, process)
+        coverage.attach(process)
+
+    iperfStart = time.monotonic()
+    remaining = IperfDuration
+    suspended = False
+    incomplete = False
     counter = 0
     while True:
         InstrumentData["Running_Task"] = "Running iperf data transfer"
         
-        # Execute iperf client for 60 seconds
-        print("[DialUp-Task]  Executing iperf client for 600 seconds")
-        response = execute_command("iperf3 -c 209.58.159.68 -p 5201-5210 -t 600secs")
-        print(response.decode())
+        # Execute iperf client for 600 seconds
+        print(f"[DialUp-Task]  Executing iperf client for {remaining} seconds")
+        segmentStart = time.monotonic()
+        if len(IperfServers) > 1:
+            # Imported here, the multi-server test builds on the helpers of this module
+            from DataCommunication.multiServerIperf import MultiServerIperf
+            multiServer = MultiServerIperf(IperfServers, remaining, bind_address=InstrumentData["PPP_IP"])
+            InstrumentData["Multi_Server"] = multiServer.run(on_interval, on_start=on_start)
+            print(f"[DialUp-Task]  Multi-server result: {InstrumentData['Multi_Server']}")
+            transferRate = None
+            if InstrumentData["Multi_Server"] is not None and InstrumentData["Multi_Server"]["aggregate_mean_mbps"] is not None:
+                transferRate = f"{InstrumentData['Multi_Server']['aggregate_mean_mbps']:.2f} Mbits/sec"
+        else:
+            response = run_iperf(f"iperf3 -c {IperfServer} -p {IperfPorts} -t {remaining}secs --forceflush",
+                                 on_interval, on_start=on_start)
+            print(response.decode())
+            transferRate = parse_iperf_result(response.decode())
         counter += 1
 
-        if response:
-            # Parse the iperf results
-            lines = response.decode().splitlines()
-            colomns = lines[-3].split()
-            print(f"[DialUp-Task] Transfer Rate: {colomns[6]} {colomns[7]}")
+        # Suspended on an outage: resume once registered and the link is back, for the remaining time
+        if SuspendOnOutage and not coverage.covered(segmentStart, time.monotonic()):
+            suspended = True
+            InstrumentData["Running_Task"] = "Suspended: out of coverage"
+            InstrumentData["Link_Expected"] = False
+            if not coverage.wait_in_coverage(MaxSuspendTime):
+                print(f"[DialUp-Task]  No coverage for {MaxSuspendTime} seconds, ending the test incomplete")
+                incomplete = True
+                if coverage.samples:
+                    InstrumentData["Running_Task"] = "Test Incomplete: out of coverage"
+                    InstrumentData["Final_Result"] = f"{coverage.summary()['raw_mean_mbps']:.2f} Mbits/sec"
+                else:
+                    messagesQueue['Display'].put("Out of coverage, test incomplete")
+                break
+            if not os.path.isdir("/sys/class/net/ppp0"):
+                redial_link(InstrumentData)
+            InstrumentData["Link_Expected"] = True
+            remaining = IperfDuration - int(sum(sample[1] for sample in coverage.samples if sample[3]))
+            counter = 0
+            if remaining > 0:
+                continue
+
+        # A suspended test spans several iperf runs, its result is the mean of their samples
+        if suspended and coverage.samples and (transferRate or remaining <= 0):
+            transferRate = f"{coverage.summary()['raw_mean_mbps']:.2f} Mbits/sec"
+
+        if transferRate:
+            print(f"[DialUp-Task] Transfer Rate: {transferRate}")
 
             # Update the Instrument Data for display
             InstrumentData["Running_Task"] = "Test Completed"
-            InstrumentData["Final_Result"] = f"{colomns[6]} {colomns[7]}" 
+            InstrumentData["Final_Result"] = transferRate
             break
         else:
             # wait for 5 seconds before retrying
             time.sleep(5)
 
+            # Attempts made while the watchdog restores the link do not count
+            while InstrumentData.get("Recovery_Active"):
+                time.sleep(1)
+                counter = 0
+
         if counter > 5:
             print("[DialUp-Task]  Failed to get iperf results")
             messagesQueue['Display'].put("iperf Connection Failed")
             break
 
+    # Stop the loaded latency probe as soon as iperf is done, so it covers the loaded time only
+    InstrumentData["Latency_Loaded"] = latencyProbe.stop().summary()
+    InstrumentData["Latency_Loaded"]["restarts"] = latencyProbe.restarts
+    InstrumentData["Latency_Loaded"]["error"] = latencyProbe.error
+    print(f"[DialUp-Task]  Loaded latency: {InstrumentData['Latency_Loaded']}")
+
+    coverage.stop()
+    InstrumentData["Coverage"] = coverage.summary()
+    InstrumentData["Coverage"]["incomplete"] = incomplete
+    print(f"[DialUp-Task]  Coverage: {InstrumentData['Coverage']}")
+
+    # Cross-check iperf against the interface counters over the iperf run.
+    # iperf3 runs as client, so the test traffic is the tx direction
+    InstrumentData["Interface_Throughput"] = ifaceSampler.summary(iperfStart, time.monotonic())
+    ifaceSampler.stop()
+    if InstrumentData["Interface_Throughput"] is not None and "Final_Result" in InstrumentData:
+        value, unit = InstrumentData["Final_Result"].split()
+        iperfMbps = to_mbps(value, unit)
+        txMbps = InstrumentData["Interface_Throughput"]["tx_mean_mbps"]
+        InstrumentData["Interface_Throughput"]["iperf_mbps"] = iperfMbps
+        InstrumentData["Interface_Throughput"]["iperf_vs_interface"] = round(iperfMbps / txMbps, 3) if txMbps else None
+    print(f"[DialUp-Task]  Interface throughput: {InstrumentData['Interface_Throughput']}")
+
+    InstrumentData["Resource_Usage"] = resourceMonitor.summary(iperfStart, time.monotonic())
+    resourceMonitor.stop()
+    print(f"[DialUp-Task]  Resource usage: {InstrumentData['Resource_Usage']}")
+    if InstrumentData["Resource_Usage"] is not None and InstrumentData["Resource_Usage"]["bench_limited"]:
+        print(f"[DialUp-Task]  Result may be limited by the test bench: {InstrumentData['Resource_Usage']['flags']}")
+
     # Terminate the dialup connection
-    print("[DialUp-Task]  Terminating Dialup Connection")
-    response = execute_command("sudo poff MyProvider")
-    print(response.decode())
+    InstrumentData["Link_Expected"] = False
+    teardown_link()
 
     print("[DialUp-Task]  Dialup Task Completed")
     return
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import time
+
+Module = "[IperfStandIn]"
+
+# Mbit/s per server port, e.g. "5301=20,5302=2". Ports not listed send at DefaultRate
+RatesEnv = "IPERF_STANDIN_RATES"
+# Ports whose server answers busy, e.g. "5303"
+BusyEnv = "IPERF_STANDIN_BUSY"
+# Set to leave --json-stream out of --help, like iperf3 before 3.17
+TextOnlyEnv = "IPERF_STANDIN_TEXT_ONLY"
+
+DefaultRate = 10.0
+
+
+def port_setting(env, port, default=None):
+    """
+    Look up the value of a port in a "port=value,..." environment variable.
+    """
+    for item in os.environ.get(env, "").split(","):
+        key, _, value = item.partition("=")
+        if key.strip() == port:
+            return value.strip() or default
+    return default
+
+
+def text_line(start, end, mbps, role=""):
+    mbytes = mbps * (end - start) / 8
+    return f"[  5]   {start:.2f}-{end:.2f}  sec  {mbytes:.2f} MBytes  {mbps:.2f} Mbits/sec  {role}".rstrip()
+
+
+def json_event(event, data):
+    return json.dumps({"event": event, "data": data})
+
+
+def run_client(args):
+    """
+    Print what an iperf3 client against a server at a fixed rate prints, one interval per second.
+
+    Returns:
+        int: The exit code.
+    """
+    if args.port in [port.strip() for port in os.environ.get(BusyEnv, "").split(",")]:
+        message = "the server is busy running a test. try again later"
+        print(json_event("error", message) if args.json_stream else f"iperf3: error - {message}", flush=True)
+        return 1
+
+    rate = float(port_setting(RatesEnv, args.port, DefaultRate))
+    if args.json_stream:
+        print(json_event("start", {"connecting_to": {"host": args.client, "port": args.port}}), flush=True)
+    else:
+        print(f"Connecting to host {args.client}, port {args.port}", flush=True)
+
+    start_time = time.monotonic()
+    for second in range(args.time):
+        # Absolute schedule, like iperf3 the intervals do not drift
+        time.sleep(max(0.0, start_time + second + 1 - time.monotonic()))
+        if args.json_stream:
+            total = {"start": float(second), "end": float(second + 1), "bits_per_second": rate * 1e6, "omitted": False}
+            print(json_event("interval", {"streams": [total], "sum": total}), flush=True)
+        else:
+            print(text_line(second, second + 1, rate), flush=True)
+
+    if args.json_stream:
+        total = {"start": 0.0, "end": float(args.time), "bits_per_second": rate * 1e6}
+        print(json_event("end", {"sum_sent": total, "sum_received": total}), flush=True)
+    else:
+        print(text_line(0, args.time, rate, "sender"))
+        print(text_line(0, args.time, rate, "receiver"))
+        print("\niperf Done.", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    # Stands in for the iperf3 client, e.g. to try the multi-server test without servers:
+    # IPERF_STANDIN_RATES="5302=2" python -m DataCommunication.multiServerIperf \
+    #     --binary DataCommunication/iperfStandIn.py 127.0.0.1:5301 127.0.0.1:5302 -t 5
+    if "--help" in sys.argv[1:]:
+        print("Usage: iperf3 -c <host> [-p port] [-t time] [-i interval] [-B address] [--forceflush]"
+              + ("" if os.environ.get(TextOnlyEnv) else " [--json-stream]"))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="iperf3 client stand-in")
+    parser.add_argument("-c", "--client", required=True)
+    parser.add_argument("-p", "--port", default="5201")
+    parser.add_argument("-t", "--time", type=int, default=10)
+    parser.add_argument("-i", "--interval", type=float, default=1)
+    parser.add_argument("-B", "--bind")
+    parser.add_argument("--json-stream", action="store_true")
+    parser.add_argument("--forceflush", action="store_true")
+    sys.exit(run_client(parser.parse_args()))
@@ -0,0 +1,336 @@
+import math
+import re
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+Module = "[Latency]"
+
+# Echo frame used by the TCP/UDP probes: sequence number + send timestamp (ns)
+ECHO_FRAME = struct.Struct("!QQ")
+
+
+class RttHistogram:
+    """
+    A compact log-bucketed histogram for round trip times.
+
+    Every bucket is `precision` wider than the previous one, so the relative
+    error of a reported percentile is bounded by `precision` while the whole
+    range of 0.1 ms to 60 s fits in a few hundred counters.
+
+    Args:
+        min_ms (float): The lower edge of the first bucket. Defaults to 0.1 ms.
+        max_ms (float): Samples above this value land in the last bucket. Defaults to 60 s.
+        precision (float): The relative width of each bucket. Defaults to 2%.
+
+    Attributes:
+        counts (list): The per bucket sample counts.
+        samples (int): The number of received replies.
+        lost (int): The number of probes that got no reply.
+    """
+    def __init__(self, min_ms=0.1, max_ms=60000.0, precision=0.02):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.log_base = math.log1p(precision)
+        self.counts = [0] * (self.bucket_index(max_ms) + 1)
+        self.samples = 0
+        self.lost = 0
+        self.min_seen = None
+        self.max_seen = None
+
+    def bucket_index(self, rtt_ms):
+        """
+        Get the bucket index for a round trip time.
+
+        Args:
+            rtt_ms (float): The round trip time in milliseconds.
+
+        Returns:
+            int: The bucket index.
+        """
+        if rtt_ms <= self.min_ms:
+            return 0
+        return int(math.log(rtt_ms / self.min_ms) / self.log_base) + 1
+
+    def bucket_value(self, index):
+        """
+        Get the representative (upper edge) value of a bucket.
+
+        Args:
+            index (int): The bucket index.
+
+        Returns:
+            float: The round trip time in milliseconds.
+        """
+        return self.min_ms * math.exp(index * self.log_base)
+
+    def record(self, rtt_ms):
+        """
+        Record one probe result.
+
+        Args:
+            rtt_ms (float): The round trip time in milliseconds, None if the probe was lost.
+        """
+        if rtt_ms is None:
+            self.lost += 1
+            return
+
+        index = min(self.bucket_index(rtt_ms), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.samples += 1
+        self.min_seen = rtt_ms if self.min_seen is None else min(self.min_seen, rtt_ms)
+        self.max_seen = rtt_ms if self.max_seen is None else max(self.max_seen, rtt_ms)
+
+    def percentile(self, pct):
+        """
+        Get a percentile of the recorded round trip times.
+
+        Args:
+            pct (float): The percentile, 0-100.
+
+        Returns:
+            float: The round trip time in milliseconds, None if nothing was recorded.
+        """
+        if self.samples == 0:
+            return None
+
+        rank = max(1, math.ceil(self.samples * pct / 100.0))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                # Never report beyond what was actually observed
+                return min(max(self.bucket_value(index), self.min_seen), self.max_seen)
+        return self.max_seen
+
+    def summary(self):
+        """
+        Summarise the histogram for the result JSON.
+
+        Returns:
+            dict: Sample counts and p50/p95/p99/min/max round trip times in ms.
+        """
+        def rounded(value):
+            return round(value, 2) if value is not None else None
+
+        total = self.samples + self.lost
+        return {
+            "samples": self.samples,
+            "lost": self.lost,
+            "loss_pct": round(100.0 * self.lost / total, 2) if total else None,
+            "min_ms": rounded(self.min_seen),
+            "p50_ms": rounded(self.percentile(50)),
+            "p95_ms": rounded(self.percentile(95)),
+            "p99_ms": rounded(self.percentile(99)),
+            "max_ms": rounded(self.max_seen),
+        }
+
+
+class LatencyProbe:
+    """
+    Measures round trip times towards a target, either once for a fixed
+    number of probes (idle baseline) or continuously in a background thread
+    while another test loads the link.
+
+    Args:
+        target (str): The host to probe.
+        method (str): "icmp" (uses ping), "udp" or "tcp" (echo service). Defaults to "icmp".
+        port (int): The echo port for the udp/tcp methods. Defaults to 7.
+        interface (str): The interface to send ICMP probes from, e.g. "ppp0". Defaults to None.
+        source_address (str): The local address to bind udp/tcp probes to. Defaults to None.
+        interval (float): The time between probes in seconds. Defaults to 0.2.
+        timeout (float): The time to wait for a reply in seconds. Defaults to 2.
+
+    Attributes:
+        histogram (RttHistogram): The histogram of the running (or last) continuous probe.
+        restarts (int): How often the continuous probe ended on its own and was restarted.
+        error (str): Why the probe could not start (e.g. no ping installed), None if it ran.
+    """
+    def __init__(self, target, method="icmp", port=7, interface=None, source_address=None, interval=0.2, timeout=2.0):
+        if method not in ("icmp", "udp", "tcp"):
+            raise ValueError(f"Unknown latency probe method: {method}")
+        self.target = target
+        self.method = method
+        self.port = port
+        self.interface = interface
+        self.source_address = source_address
+        self.interval = interval
+        self.timeout = timeout
+        self.histogram = RttHistogram()
+        self.restarts = 0
+        self.error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._process = None
+
+    def run_baseline(self, count=20):
+        """
+        Run a fixed number of probes and wait for them to complete.
+
+        Args:
+            count (int): The number of probes to send. Defaults to 20.
+
+        Returns:
+            RttHistogram: The histogram of the probes.
+        """
+        histogram = RttHistogram()
+        self._stop_event.clear()
+        for rtt_ms in self._samples(count):
+            histogram.record(rtt_ms)
+        return histogram
+
+    def start(self):
+        """
+        Start probing continuously in a background thread.
+        """
+        self.histogram = RttHistogram()
+        self.restarts = 0
+        self.error = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background probing.
+
+        Returns:
+            RttHistogram: The histogram of the probes sent since start().
+        """
+        self._stop_event.set()
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        if self._thread is not None:
+            self._thread.join(self.timeout + self.interval + 1)
+            self._thread = None
+        return self.histogram
+
+    def _run(self):
+        while True:
+            for rtt_ms in self._samples():
+                self.histogram.record(rtt_ms)
+            # A probe that can not start at all will not start on a retry either
+            if self._stop_event.is_set() or self.error is not None:
+                break
+            # ping exits when its interface goes away, e.g. while the link is re-dialled
+            self.restarts += 1
+            print(f"{Module} Probe ended unexpectedly, restarting")
+            self._stop_event.wait(1)
+
+    def _samples(self, count=None):
+        """
+        Generate probe results until `count` probes were sent or stop() is called.
+
+        Yields:
+            float: The round trip time in milliseconds, None for a lost probe.
+        """
+        if self.method == "icmp":
+            yield from self._icmp_samples(count)
+        else:
+            yield from self._echo_samples(count)
+
+    def _icmp_samples(self, count):
+        # A single long running ping is far cheaper than forking one per probe
+        command = ["ping", "-n", "-O", "-i", str(self.interval), "-W", str(max(1, int(math.ceil(self.timeout))))]
+        if count is not None:
+            command += ["-c", str(count)]
+        if self.interface:
+            command += ["-I", self.interface]
+        command.append(self.target)
+
+        try:
+            self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        except OSError as e:
+            print(f"{Module} Unable to start ping: {e}")
+            self.error = f"Unable to start ping: {e}"
+            return
+
+        try:
+            for line in self._process.stdout:
+                match = re.search(r"time[=<]([\d.]+) ms", line)
+                if match:
+                    yield float(match.group(1))
+                elif "no answer yet" in line:
+                    yield None
+                if self._stop_event.is_set():
+                    break
+        finally:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def _echo_samples(self, count):
+        sock = None
+        seq = 0
+        while count is None or seq < count:
+            if self._stop_event.is_set():
+                break
+
+            sent_at = time.perf_counter()
+            try:
+                if sock is None:
+                    sock = self._open_socket()
+                yield self._echo_once(sock, seq)
+            except OSError:
+                # Lost probe. Start from a fresh socket so a late reply can not be
+                # mistaken for the next one
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                yield None
+            seq += 1
+
+            self._stop_event.wait(max(0.0, self.interval - (time.perf_counter() - sent_at)))
+
+        if sock is not None:
+            sock.close()
+
+    def _open_socket(self):
+        source = (self.source_address, 0) if self.source_address else None
+        if self.method == "tcp":
+            sock = socket.create_connection((self.target, self.port), timeout=self.timeout, source_address=source)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if source:
+                sock.bind(source)
+            sock.connect((self.target, self.port))
+        sock.settimeout(self.timeout)
+        return sock
+
+    def _echo_once(self, sock, seq):
+        """
+        Send one echo frame and wait for the matching reply.
+
+        Returns:
+            float: The round trip time in milliseconds.
+        """
+        sent_ns = time.perf_counter_ns()
+        sock.send(ECHO_FRAME.pack(seq, sent_ns))
+        deadline = time.perf_counter() + self.timeout
+
+        while True:
+            sock.settimeout(max(0.001, deadline - time.perf_counter()))
+            if self.method == "tcp":
+                frame = self._recv_exact(sock, ECHO_FRAME.size)
+            else:
+                frame = sock.recv(ECHO_FRAME.size)
+            if len(frame) < ECHO_FRAME.size:
+                continue
+            reply_seq, reply_ns = ECHO_FRAME.unpack(frame)
+            if reply_seq == seq and reply_ns == sent_ns:
+                return (time.perf_counter_ns() - sent_ns) / 1e6
+
+    @staticmethod
+    def _recv_exact(sock, size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Echo connection closed")
+            data += chunk
+        return data
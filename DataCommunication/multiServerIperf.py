@@ -0,0 +1,299 @@
+import argparse
+import json
+import math
+import statistics
+import subprocess
+import threading
+import time
+from Common.units import to_mbps
+from DataCommunication.dataOverDialup import parse_iperf_interval
+
+Module = "[MultiIperf]"
+
+# A server whose mean is below this share of the median server mean is lagging
+LagRatio = 0.5
+
+
+def split_server(server, default_ports="5201"):
+    """
+    Split a server entry, e.g. "198.51.100.7:5201-5210" -> ("198.51.100.7", "5201-5210").
+    """
+    host, sep, ports = server.rpartition(":")
+    if not sep or not ports.replace("-", "").isdigit():
+        return server, default_ports
+    return host, ports
+
+
+def supports_json_stream(binary="iperf3"):
+    """
+    Check whether iperf3 has --json-stream (3.17 and newer).
+    """
+    try:
+        output = subprocess.run([binary, "--help"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return "--json-stream" in output.stdout + output.stderr
+
+
+class IperfClient:
+    """
+    One iperf3 client of a multi-server run, collecting its intervals.
+
+    Interval times are relative to the client's own test start, which is
+    placed on the shared clock from the arrival of its first interval.
+    """
+    def __init__(self, server, command, json_stream):
+        self.server = server
+        self.command = command
+        self.json_stream = json_stream
+        self.process = None
+        self.origin = None
+        self.intervals = []
+        self.receiver_mbps = None
+        self.error = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+    def read(self, on_interval):
+        """
+        Read the client output until it exits.
+
+        Args:
+            on_interval (callable): Called with the client after every interval.
+        """
+        for line in self.process.stdout:
+            interval = self.parse_line(line)
+            if interval is None:
+                continue
+            start, end, mbps = interval
+            if self.origin is None:
+                self.origin = time.monotonic() - end
+            self.intervals.append((self.origin + start, self.origin + end, mbps))
+            on_interval(self)
+        self.process.wait()
+        if not self.intervals and self.error is None:
+            self.error = f"no intervals, exit code {self.process.returncode}"
+
+    def parse_line(self, line):
+        if not self.json_stream:
+            if "receiver" in line:
+                fields = line.split()
+                for index, field in enumerate(fields):
+                    if field.endswith("bits/sec"):
+                        self.receiver_mbps = to_mbps(fields[index - 1], field)
+            elif "iperf3: error" in line:
+                self.error = line.strip()
+            return parse_iperf_interval(line)
+
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return None
+        data = event.get("data")
+        if event.get("event") == "interval":
+            total = data["sum"]
+            if total.get("omitted"):
+                return None
+            return total["start"], total["end"], total["bits_per_second"] / 1e6
+        if event.get("event") == "end":
+            received = data.get("sum_received") or {}
+            if "bits_per_second" in received:
+                self.receiver_mbps = received["bits_per_second"] / 1e6
+        elif event.get("event") == "error":
+            self.error = str(data)
+        return None
+
+    @property
+    def reported_until(self):
+        """
+        The shared-clock time up to which this client has reported, inf once it has exited.
+        """
+        if self.process.poll() is not None:
+            return math.inf
+        return self.intervals[-1][1] if self.intervals else -math.inf
+
+
+class MultiServerIperf:
+    """
+    Runs coordinated iperf3 clients against several servers at once and
+    merges them into one aggregate per-second throughput.
+
+    All clients are launched together once their reader threads are ready,
+    and bound to the same source address. Each client's intervals are
+    placed on a shared clock and spread over one-second bins of the
+    aggregate, so clients whose tests started a little apart still add up
+    correctly. A bin is reported as soon as every running client has
+    covered it. The first and the last bin are only partly covered and are
+    left out, both live and in the summary. Clients use --json-stream when
+    iperf3 supports it, and the --forceflush text output otherwise.
+
+    Args:
+        servers (list): The servers, "host" or "host:ports", e.g. "198.51.100.7:5201-5210".
+        duration (int): The test duration in seconds.
+        bind_address (str): The source address, e.g. the ppp0 address. Defaults to None.
+        binary (str): The iperf3 binary. Defaults to "iperf3".
+        json_stream (bool): Use --json-stream. Defaults to detecting it.
+    """
+    def __init__(self, servers, duration, bind_address=None, binary="iperf3", json_stream=None):
+        self.duration = duration
+        self.json_stream = supports_json_stream(binary) if json_stream is None else json_stream
+        self.clients = []
+        for server in servers:
+            host, ports = split_server(server)
+            command = [binary, "-c", host, "-p", ports, "-t", str(duration), "-i", "1"]
+            if bind_address:
+                command += ["-B", bind_address]
+            command += ["--json-stream"] if self.json_stream else ["--forceflush"]
+            self.clients.append(IperfClient(server, command, self.json_stream))
+        self.origin = None
+        self.bins = []
+        # The next bin to report, bin 0 is only partly covered
+        self.emitted = 1
+        self.reported = []
+        self.lock = threading.Lock()
+        self.on_interval = None
+
+    def poll(self):
+        """
+        Like Popen.poll(): None while any client is running.
+        """
+        codes = [client.process.poll() if client.process else 0 for client in self.clients]
+        return None if None in codes else max(codes)
+
+    def terminate(self):
+        """
+        Like Popen.terminate(): stop every client.
+        """
+        for client in self.clients:
+            if client.process is not None and client.process.poll() is None:
+                client.process.terminate()
+
+    def run(self, on_interval=None, on_start=None):
+        """
+        Run all clients to completion.
+
+        Args:
+            on_interval (callable): Called with (start, end, Mbit/s) for every aggregate second. Defaults to None.
+            on_start (callable): Called with this object once the clients run, e.g. to terminate them early. Defaults to None.
+
+        Returns:
+            dict: Per-server and aggregate results, see summary().
+        """
+        self.on_interval = on_interval
+        ready = threading.Barrier(len(self.clients) + 1)
+        started = threading.Barrier(len(self.clients) + 1)
+
+        def worker(client):
+            ready.wait()
+            try:
+                client.start()
+            except OSError as e:
+                client.error = str(e)
+            started.wait()
+            if client.process is not None:
+                client.read(self.merge)
+
+        threads = [threading.Thread(target=worker, args=(client,), daemon=True) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        # Release every client at the same moment
+        self.origin = time.monotonic()
+        ready.wait()
+        started.wait()
+        print(f"{Module} Started {len(self.clients)} clients ({'json-stream' if self.json_stream else 'text'})")
+        if on_start is not None:
+            on_start(self)
+
+        for thread in threads:
+            thread.join()
+        self.merge(None)
+        return self.summary()
+
+    def merge(self, client):
+        """
+        Spread the newest interval of a client over the aggregate bins and report completed bins.
+        """
+        with self.lock:
+            if client is not None:
+                start, end, mbps = client.intervals[-1]
+                for second in range(max(0, int(start - self.origin)), int(math.ceil(end - self.origin))):
+                    while len(self.bins) <= second:
+                        self.bins.append(0.0)
+                    overlap = min(end, self.origin + second + 1) - max(start, self.origin + second)
+                    if overlap > 0:
+                        self.bins[second] += mbps * overlap
+
+            running = [c.reported_until for c in self.clients if c.process is not None]
+            complete = min(running) - self.origin if running else math.inf
+            final = client is None
+            end = len(self.bins)
+            if final:
+                if self.reported or len(self.bins) > 2:
+                    # The last bin is only partly covered as well
+                    end -= 1
+                else:
+                    # Too short a run to leave out the partial bins
+                    self.emitted = 0
+            while self.emitted < end and (final or self.emitted + 1 <= complete):
+                self.reported.append(self.bins[self.emitted])
+                if self.on_interval is not None:
+                    self.on_interval(float(self.emitted), float(self.emitted + 1), self.bins[self.emitted])
+                self.emitted += 1
+
+    def summary(self):
+        """
+        Summarise the run.
+
+        Returns:
+            dict: Per server its mean, receiver rate, error and whether it lagged, and
+                the aggregate mean, peak and per-second series of the reported bins.
+                None if no client reported.
+        """
+        servers = []
+        for client in self.clients:
+            mean = None
+            if client.intervals:
+                seconds = sum(end - start for start, end, _ in client.intervals)
+                mean = sum((end - start) * mbps for start, end, mbps in client.intervals) / seconds if seconds else 0.0
+            servers.append({
+                "server": client.server,
+                "mean_mbps": round(mean, 3) if mean is not None else None,
+                "receiver_mbps": round(client.receiver_mbps, 3) if client.receiver_mbps is not None else None,
+                "intervals": len(client.intervals),
+                "error": client.error,
+            })
+
+        means = [server["mean_mbps"] for server in servers if server["mean_mbps"] is not None]
+        if not means:
+            return None
+        median = statistics.median(means)
+        for server in servers:
+            server["lagging"] = server["mean_mbps"] is None or server["mean_mbps"] < LagRatio * median
+
+        # The same bins as reported live, so the aggregate matches the per-second series
+        reported = self.reported
+        return {
+            "format": "json-stream" if self.json_stream else "text",
+            "servers": servers,
+            "lagging": [server["server"] for server in servers if server["lagging"]],
+            "aggregate_mean_mbps": round(sum(reported) / len(reported), 3) if reported else None,
+            "aggregate_peak_mbps": round(max(reported), 3) if reported else None,
+            "aggregate_intervals": [round(value, 3) for value in reported],
+        }
+
+
+if __name__ == "__main__":
+    # E.g. against local servers: iperf3 -s -p 5301 & iperf3 -s -p 5302 &
+    # or without them: --binary DataCommunication/iperfStandIn.py
+    parser = argparse.ArgumentParser(description="Aggregate iperf3 throughput over several servers")
+    parser.add_argument("servers", nargs="+", help='"host" or "host:ports"')
+    parser.add_argument("-t", "--time", type=int, default=10)
+    parser.add_argument("-B", "--bind", help="source address")
+    parser.add_argument("--text", action="store_true", help="force the text output parser")
+    parser.add_argument("--binary", default="iperf3", help="the iperf3 client binary")
+    args = parser.parse_args()
+
+    multi = MultiServerIperf(args.servers, args.time, args.bind, binary=args.binary, json_stream=False if args.text else None)
+    result = multi.run(lambda start, end, mbps: print(f"{Module} {start:4.0f}-{end:<4.0f} {mbps:8.2f} Mbit/s"))
+    print(json.dumps(result, indent=4))
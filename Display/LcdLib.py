@@ -1,14 +1,25 @@
 import time
-import subprocess
-import digitalio
-import board
-from PIL import Image, ImageDraw, ImageFont
-from adafruit_rgb_display import st7789
+from Common.startupMetrics import record_metric, timed_import
+from Display.displayBackends import create_backend
 
 # Alternatively load a TTF font.  Make sure the .ttf font file is in the
 # same directory as the python script!
 # Some other nice fonts to try: http://www.dafont.com/bitmap.php
-font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
+FontPath = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+font = None
+
+
+def LoadFont():
+    """
+    Load the font on first use, headless runs never need it
+
+    Returns:
+        font: the PIL font
+    """
+    global font
+    if font is None:
+        font = timed_import("PIL.ImageFont").truetype(FontPath, 12)
+    return font
 
 
 # create connection dictionary
@@ -27,51 +38,182 @@ connectionStatus = {
     11: "Registered CSFB SMS and Data",
 }
 
-def InitLcdScreen():
+# Live view layout (landscape, pixels)
+StatusBarHeight = 16
+TaskAreaHeight = 32
+GraphTop = StatusBarHeight + TaskAreaHeight
+GraphColumnWidth = 2
+
+
+class ThroughputRing:
     """
-    Initialize the LCD screen
+    A fixed-size ring buffer of throughput samples.
 
-    Returns:
-        disp: the display object
+    Args:
+        capacity (int): The number of samples to keep.
+
+    Attributes:
+        values (list): The preallocated sample storage.
+        count (int): The number of valid samples.
+    """
+    def __init__(self, capacity):
+        self.values = [0.0] * capacity
+        self.head = 0
+        self.count = 0
+
+    def push(self, value):
+        """
+        Add a sample, overwriting the oldest one when the buffer is full.
+        """
+        self.values[self.head] = value
+        self.head = (self.head + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    def samples(self):
+        """
+        Get the valid samples.
+
+        Returns:
+            list: The samples from oldest to newest.
+        """
+        start = (self.head - self.count) % len(self.values)
+        return [self.values[(start + i) % len(self.values)] for i in range(self.count)]
+
+
+class LiveView:
     """
+    Live test view with a status bar, the running task and a scrolling
+    throughput sparkline.
 
-    # Configuration for CS and DC pins (these are FeatherWing defaults on M0/M4):
-    cs_pin = digitalio.DigitalInOut(board.CE0)
-    dc_pin = digitalio.DigitalInOut(board.D25)
-    reset_pin = None
-
-    # Config for display baudrate (default max is 24mhz):
-    BAUDRATE = 64000000
-
-    # Setup SPI bus using hardware SPI:
-    spi = board.SPI()
-
-    # Create the ST7789 display:
-    disp = st7789.ST7789(
-        spi,
-        cs=cs_pin,
-        dc=dc_pin,
-        rst=reset_pin,
-        baudrate=BAUDRATE,
-        width=135,
-        height=240,
-        x_offset=53,
-        y_offset=40,
-    )
+    The view keeps its own framebuffer and only redraws (and sends to the
+    display) the region that changed: the status bar when the registration
+    state or RSSI change, the task area when its text changes and, once per
+    throughput sample, the graph is shifted left by one column and only the
+    new column is drawn.
 
-    # Create blank image for drawing.
-    # Make sure to create image with mode 'RGB' for full color.
-    height = disp.width  # we swap height/width to rotate it to landscape!
-    width = disp.height
-    image = Image.new("RGB", (width, height))
-    rotation = 270
+    Args:
+        disp: the display backend
+    """
+    def __init__(self, disp):
+        Image = timed_import("PIL.Image")
+        ImageDraw = timed_import("PIL.ImageDraw")
+        self.disp = disp
+        self.width = disp.width
+        self.height = disp.height
+        self.image = Image.new("RGB", (self.width, self.height))
+        self.draw = ImageDraw.Draw(self.image)
+        self.font = LoadFont()
+        self.ring = ThroughputRing(self.width // GraphColumnWidth)
+        self.scale = 1.0
+        self.status = None
+        self.task = None
+
+    def push_region(self, box):
+        """
+        Send one region of the framebuffer to the display.
+
+        Args:
+            box: (x0, y0, x1, y1) of the region in landscape coordinates
+        """
+        self.disp.show_region(self.image, box)
+
+    def update_status(self, network_status, rssi):
+        """
+        Redraw the status bar if the registration state or RSSI changed.
+        """
+        if (network_status, rssi) == self.status:
+            return
+        self.status = (network_status, rssi)
+
+        box = (0, 0, self.width, StatusBarHeight)
+        self.draw.rectangle((0, 0, self.width - 1, StatusBarHeight - 1), fill=(0, 0, 32))
+        self.draw.text((2, 1), connectionStatus.get(network_status, "Unknown"), font=self.font, fill="#FFFFFF")
+
+        # AT+CSQ reports 99 (or 199 when the query failed) for unknown RSSI
+        rssiText = f"{-113 + 2 * rssi} dBm" if rssi is not None and rssi < 99 else "-- dBm"
+        textWidth = self.draw.textlength(rssiText, font=self.font)
+        self.draw.text((self.width - textWidth - 2, 1), rssiText, font=self.font, fill="#FFFF00")
+        self.push_region(box)
+
+    def update_task(self, runningTask, throughtput=""):
+        """
+        Redraw the task area if the running task or the throughput text changed.
+        """
+        if throughtput == "" and self.ring.count:
+            throughtput = f"{self.ring.values[self.ring.head - 1]:.2f} Mbits/sec (live)"
+
+        if (runningTask, throughtput) == self.task:
+            return
+        self.task = (runningTask, throughtput)
+
+        box = (0, StatusBarHeight, self.width, GraphTop)
+        self.draw.rectangle((0, StatusBarHeight, self.width - 1, GraphTop - 1), outline=0, fill=(0, 0, 0))
+        self.draw.text((2, StatusBarHeight), f"Task: {runningTask}", font=self.font, fill="#00FF00")
+        if throughtput != "":
+            self.draw.text((2, StatusBarHeight + 15), f"Throughput: {throughtput}", font=self.font, fill="#00FF00")
+        self.push_region(box)
+
+    def add_sample(self, mbps):
+        """
+        Add a throughput sample and scroll the graph by one column.
+
+        Args:
+            mbps: the throughput in Mbit/s
+        """
+        self.ring.push(mbps)
+        box = (0, GraphTop, self.width, self.height)
+
+        if mbps > self.scale:
+            # Grow the scale in powers of two so full redraws stay rare
+            while mbps > self.scale:
+                self.scale *= 2
+            self.draw.rectangle((0, GraphTop, self.width - 1, self.height - 1), outline=0, fill=(0, 0, 0))
+            samples = self.ring.samples()
+            offset = self.width - len(samples) * GraphColumnWidth
+            for i, value in enumerate(samples):
+                self.draw_column(offset + i * GraphColumnWidth, value)
+        else:
+            # Shift the existing graph left by one column and draw only the new one
+            shifted = self.image.crop((GraphColumnWidth, GraphTop, self.width, self.height))
+            self.image.paste(shifted, (0, GraphTop))
+            self.draw.rectangle((self.width - GraphColumnWidth, GraphTop, self.width - 1, self.height - 1), outline=0, fill=(0, 0, 0))
+            self.draw_column(self.width - GraphColumnWidth, mbps)
+
+        self.push_region(box)
+
+    def column_drawn(self, x):
+        """
+        Check that a graph column holds a bar, i.e. is not all black.
+        """
+        return self.image.crop((x, GraphTop, x + GraphColumnWidth, self.height)).getbbox() is not None
+
+    def draw_column(self, x, mbps):
+        """
+        Draw one sample column of the graph.
+        """
+        graphHeight = self.height - GraphTop
+        barHeight = int(round(min(mbps / self.scale, 1.0) * (graphHeight - 1)))
+        if barHeight > 0:
+            # No outline, on a column this narrow it would cover the whole bar
+            self.draw.rectangle((x, self.height - barHeight, x + GraphColumnWidth - 1, self.height - 1), fill="#00C0FF")
+
+
+def InitLcdScreen(backend=None):
+    """
+    Initialize the LCD screen
 
-    # Get drawing object to draw on image.
-    draw = ImageDraw.Draw(image)
+    Args:
+        backend: the display backend name, see create_backend()
+
+    Returns:
+        disp: the display backend
+    """
+    disp = create_backend(backend)
 
-    # Draw a black filled box to clear the image.
-    draw.rectangle((0, 0, width, height), outline=0, fill=(0, 0, 0))
-    disp.image(image, rotation)
+    if disp.renders:
+        # Draw a black filled box to clear the image.
+        image = timed_import("PIL.Image").new("RGB", (disp.width, disp.height))
+        disp.show(image)
 
     return disp
 
@@ -80,63 +222,32 @@ def DisplayText(disp, text, color="green"):
     Display text on the LCD screen
 
     Args:
-        disp: the display object
+        disp: the display backend
         text: the text to display
 
     Returns:
         None
     """
 
+    if not disp.renders:
+        return
+
     # Create blank image for drawing.
     # Make sure to create image with mode 'RGB' for full color.
-    height = disp.width  # we swap height/width to rotate it to landscape!
-    width = disp.height
-    image = Image.new("RGB", (width, height))
-    rotation = 270
+    image = timed_import("PIL.Image").new("RGB", (disp.width, disp.height))
 
     # Get drawing object to draw on image.
-    draw = ImageDraw.Draw(image)
-
-    # Draw a black filled box to clear the image.
-    draw.rectangle((0, 0, disp.width, disp.height), outline=0, fill=(0, 0, 0))
+    draw = timed_import("PIL.ImageDraw").Draw(image)
 
     if color == "red":
         # Draw the text
-        draw.text((0, -2), text, font=font, fill="#FF0000")
+        draw.text((0, -2), text, font=LoadFont(), fill="#FF0000")
     else:
         # Draw the text
-        draw.text((0, -2), text, font=font, fill="#00FF00")
+        draw.text((0, -2), text, font=LoadFont(), fill="#00FF00")
 
     # Display the image
-    disp.image(image, rotation)
-
-    return
-
-def ShowTestUpdates(disp, network_status, runningTask, throughtput=""):
-    """
-    Show test updates on the LCD screen
-
-    Args:
-        disp: the display object
-        network_status: the network status
-        runningTask: the current running task
-        throughtput: the throughput
-
-    Returns:
-        None
-    """
-    displayText = ""
-
-    if network_status == "" or runningTask == "":
-        return
-    else:
-        displayText += f"Network: {connectionStatus[network_status]}\n"
-        displayText += f"Task: {runningTask}"
-
-    if throughtput != "":
-        displayText += f"\nThroughput: {throughtput}"
-
-    DisplayText(disp, displayText)
+    disp.show(image)
 
     return
 
@@ -145,7 +256,7 @@ def DisplayError(disp, network_status, error):
     Display error on the LCD screen
 
     Args:
-        disp: the display object
+        disp: the display backend
         error: the error message
 
     Returns:
@@ -168,7 +279,11 @@ def DisplayTask(InstrumentData, displayQueue):
         None
     """
     # Initialize the LCD screen
+    start_time = time.perf_counter()
     disp = InitLcdScreen()
+    view = LiveView(disp) if disp.renders else None
+    record_metric("display_init_s", start_time)
+    lastSampleSeq = None
 
     while InstrumentData["CloseAllThread"] != "yes":
 
@@ -189,16 +304,46 @@ def DisplayTask(InstrumentData, displayQueue):
                 DisplayError(disp, network_status, event)
                 break
 
-        else:
+        elif view is not None:
+
+            # Update status on the LCD screen, only changed regions are redrawn
+            view.update_status(network_status, InstrumentData.get("csq_rssi"))
+
+            sample = InstrumentData.get("Throughput_Sample")
+            if sample is not None and sample[0] != lastSampleSeq:
+                lastSampleSeq = sample[0]
+                view.add_sample(sample[1])
 
-            # Update status on the LCD screen
-            if 'Final_Result' in InstrumentData:
-                ShowTestUpdates(disp, network_status, InstrumentData["Running_Task"], InstrumentData["Final_Result"])
-            else:
-                ShowTestUpdates(disp, network_status, InstrumentData["Running_Task"])
+            view.update_task(InstrumentData["Running_Task"], InstrumentData.get("Final_Result", ""))
 
         # wait for message to be displayed
         time.sleep(0.1)
 
+    disp.close()
     print("[Display] Closing the display thread")
-    return
\ No newline at end of file
+    return
+
+
+if __name__ == "__main__":
+    # Render a synthetic run into a PNG, e.g. to check the live view without the panel
+    import argparse
+    import random
+    from Display.displayBackends import PngSnapshotBackend
+
+    parser = argparse.ArgumentParser(description="Render a synthetic test on the live view")
+    parser.add_argument("--samples", type=int, default=60)
+    parser.add_argument("--png", default="display.png")
+    args = parser.parse_args()
+
+    disp = PngSnapshotBackend(args.png, min_interval=0)
+    view = LiveView(disp)
+    view.update_status(1, 21)
+    missing = 0
+    for second in range(args.samples):
+        view.add_sample(max(0.5, random.gauss(12, 3)))
+        view.update_task("Running iperf data transfer")
+        if not view.column_drawn(view.width - GraphColumnWidth):
+            missing += 1
+    disp.close()
+    print(f"[Display] {args.samples} samples rendered to {args.png}, {missing} columns not drawn")
+    raise SystemExit(1 if missing else 0)
@@ -0,0 +1,174 @@
+import os
+import time
+from Common.startupMetrics import timed_import
+
+# Environment variable selecting the display backend: "auto", "st7789", "null" or "png"
+DisplayBackendEnv = "TESTBENCH_DISPLAY"
+# Environment variable with the snapshot path of the png backend
+DisplaySnapshotEnv = "TESTBENCH_DISPLAY_PNG"
+
+
+class DisplayBackend:
+    """
+    Base class of the display backends.
+
+    The drawing code renders into a landscape PIL image of width x height and
+    hands either the full image or one region of it to the backend.
+
+    Attributes:
+        width (int): The landscape width in pixels.
+        height (int): The landscape height in pixels.
+        renders (bool): Whether the backend wants rendered images at all.
+    """
+    width = 240
+    height = 135
+    renders = True
+
+    def show(self, image):
+        """
+        Show a full frame.
+
+        Args:
+            image: the landscape PIL image
+        """
+        self.show_region(image, (0, 0, self.width, self.height))
+
+    def show_region(self, image, box):
+        """
+        Show one region of a frame.
+
+        Args:
+            image: the landscape PIL image
+            box: (x0, y0, x1, y1) of the region to update
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release the backend.
+        """
+        return
+
+
+class ST7789Backend(DisplayBackend):
+    """
+    The ST7789 SPI screen of the bench, driven through Blinka.
+    """
+    def __init__(self):
+        # Hardware libraries are only needed (and only available) on the Pi
+        board = timed_import("board")
+        digitalio = timed_import("digitalio")
+        st7789 = timed_import("adafruit_rgb_display.st7789")
+
+        # Configuration for CS and DC pins (these are FeatherWing defaults on M0/M4):
+        cs_pin = digitalio.DigitalInOut(board.CE0)
+        dc_pin = digitalio.DigitalInOut(board.D25)
+        reset_pin = None
+
+        # Config for display baudrate (default max is 24mhz):
+        BAUDRATE = 64000000
+
+        # Setup SPI bus using hardware SPI:
+        spi = board.SPI()
+
+        # Create the ST7789 display:
+        self.disp = st7789.ST7789(
+            spi,
+            cs=cs_pin,
+            dc=dc_pin,
+            rst=reset_pin,
+            baudrate=BAUDRATE,
+            width=135,
+            height=240,
+            x_offset=53,
+            y_offset=40,
+        )
+
+        # we swap height/width to rotate it to landscape!
+        self.width = self.disp.height
+        self.height = self.disp.width
+
+    def show(self, image):
+        self.disp.image(image, 270)
+
+    def show_region(self, image, box):
+        x0, y0, x1, y1 = box
+        # The 270 degree rotation maps landscape (x, y) to panel (height - 1 - y, x)
+        self.disp.image(image.crop(box), 270, self.height - y1, x0)
+
+
+class NullBackend(DisplayBackend):
+    """
+    Headless backend, nothing is rendered.
+    """
+    renders = False
+
+    def show_region(self, image, box):
+        return
+
+
+class PngSnapshotBackend(DisplayBackend):
+    """
+    Headless backend that periodically writes the current frame to a PNG file.
+
+    Args:
+        path (str): The snapshot file. Defaults to "display.png".
+        min_interval (float): The minimum time between two snapshots in seconds. Defaults to 1.
+    """
+    def __init__(self, path="display.png", min_interval=1.0):
+        self.path = path
+        self.min_interval = min_interval
+        self.last_write = 0.0
+        self.pending = None
+
+    def show_region(self, image, box):
+        self.pending = image
+        if time.monotonic() - self.last_write >= self.min_interval:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        """
+        Write the pending frame, replacing the previous snapshot atomically.
+        """
+        if self.pending is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        self.pending.save(tmp_path, format="PNG")
+        os.replace(tmp_path, self.path)
+        self.pending = None
+        self.last_write = time.monotonic()
+
+    def close(self):
+        self.write_snapshot()
+
+
+def create_backend(name=None):
+    """
+    Create the display backend selected at runtime.
+
+    Args:
+        name (str): "auto", "st7789", "null" or "png". Defaults to the
+            TESTBENCH_DISPLAY environment variable, or "auto".
+
+    Returns:
+        DisplayBackend: The backend. "auto" falls back to the null backend
+        when the ST7789 can not be initialised.
+    """
+    if name is None:
+        name = os.environ.get(DisplayBackendEnv, "auto")
+
+    if name == "null":
+        return NullBackend()
+    if name == "png":
+        return PngSnapshotBackend(os.environ.get(DisplaySnapshotEnv, "display.png"))
+    if name == "st7789":
+        return ST7789Backend()
+    if name != "auto":
+        raise ValueError(f"Unknown display backend: {name}")
+
+    try:
+        return ST7789Backend()
+    except Exception as e:
+        # Blinka raises ImportError, NotImplementedError or RuntimeError off the Pi
+        print(f"[Display] ST7789 not available ({e}). Running headless")
+        return NullBackend()
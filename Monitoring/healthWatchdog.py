@@ -0,0 +1,265 @@
+import os
+import re
+import threading
+import time
+from serialCOM.at_scheduler import PRIORITY_URGENT
+from DataCommunication.dataOverDialup import redial_link
+from DataCommunication.ifaceSampler import InterfaceCounterSampler
+
+Module = "[Watchdog]"
+
+# Recovery steps in escalation order
+RecoverySteps = ["reopen_port", "cfun_toggle", "modem_reset"]
+
+
+class HealthWatchdog:
+    """
+    Watches the AT channel, the PPP link and the iperf progress, and recovers
+    them by escalating step by step.
+
+    An AT fault starts at reopening the port, then toggles CFUN=0/1, then
+    resets the module with AT+CFUN=1,1. A link fault (ppp0 gone or iperf
+    stalled) first re-dials, then escalates through the CFUN toggle and the
+    reset. iperf counts as stalled only while its process runs, without new
+    samples and without traffic on ppp0; every new link and iperf run starts
+    a new stall window. Every step that drops the data link while a test is
+    running is followed by a re-dial. Each step is recorded with its timing
+    in InstrumentData["Recovery_Log"].
+
+    Args:
+        InstrumentData: the instrument data
+        scheduler (ATCommandScheduler): The scheduler owning the AT port.
+        check_interval (float): The time between health checks in seconds. Defaults to 5.
+        at_failures (int): Consecutive failed AT probes before recovering. Defaults to 2.
+        stall_timeout (float): Seconds without iperf progress before recovering. Defaults to 30.
+        stall_mbps (float): ppp0 rx+tx below this rate counts as no traffic. Defaults to 0.01 Mbit/s.
+        sysfs_net (str): The sysfs net class directory. Defaults to "/sys/class/net".
+    """
+    def __init__(self, InstrumentData, scheduler, check_interval=5, at_failures=2, stall_timeout=30, stall_mbps=0.01,
+                 sysfs_net="/sys/class/net"):
+        self.InstrumentData = InstrumentData
+        self.scheduler = scheduler
+        self.at = scheduler.client("Watchdog", PRIORITY_URGENT)
+        self.check_interval = check_interval
+        self.at_failures = at_failures
+        self.stall_timeout = stall_timeout
+        self.stall_mbps = stall_mbps
+        self.sysfs_net = sysfs_net
+        self.counters = InterfaceCounterSampler("ppp0", sysfs_root=sysfs_net)
+        self.failed_probes = 0
+        self.level = 0
+        self.link_expected = False
+        self.last_run = None
+        self.last_sample = None
+        self.last_counters = None
+        self.last_progress = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = None
+        InstrumentData.setdefault("Recovery_Log", [])
+
+    def start(self):
+        """
+        Start watching in a background thread.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            fault = self.check()
+            if fault is None:
+                self.level = 0
+                continue
+            self.recover(fault)
+
+    def probe_at(self, timeout=2):
+        """
+        Check that the AT channel answers.
+
+        Returns:
+            bool: True if "AT" was answered with OK.
+        """
+        error_code, response = self.at.send_command_and_read_response("AT\r\n", "", timeout=timeout)
+        return error_code == 0 and re.search(r"OK", response) is not None
+
+    def link_up(self):
+        """
+        Check that the PPP interface exists.
+        """
+        return os.path.isdir(os.path.join(self.sysfs_net, "ppp0"))
+
+    def check(self):
+        """
+        Run one health check.
+
+        Returns:
+            str: "at" or "link" for the detected fault, None if healthy.
+        """
+        if self.probe_at():
+            self.failed_probes = 0
+        else:
+            self.failed_probes += 1
+            if self.failed_probes >= self.at_failures:
+                return "at"
+
+        if not self.InstrumentData.get("Link_Expected"):
+            self.link_expected = False
+            return None
+        if not self.link_up():
+            return "link"
+
+        # A link that just came up, or an iperf run that just started, has not stalled yet
+        run = self.InstrumentData.get("Iperf_Run")
+        run_seq = run[0] if run is not None else None
+        if not self.link_expected or run_seq != self.last_run:
+            self.link_expected = True
+            self.last_run = run_seq
+            self.reset_progress()
+            return None
+
+        # Progress is a new per-second iperf sample or traffic on ppp0
+        now = time.monotonic()
+        sample = self.InstrumentData.get("Throughput_Sample")
+        counters = self.counters.read_counters()
+        if sample != self.last_sample or self.traffic_mbps(counters, now) >= self.stall_mbps:
+            self.last_progress = now
+        self.last_sample = sample
+        self.last_counters = (now, counters)
+
+        # iperf retrying against a busy server is not running, and not a link fault
+        running = run is not None and run[1].poll() is None
+        if running and now - self.last_progress > self.stall_timeout:
+            return "link"
+
+        return None
+
+    def reset_progress(self):
+        """
+        Start a new stall window from the current sample and counters.
+        """
+        self.last_progress = time.monotonic()
+        self.last_sample = self.InstrumentData.get("Throughput_Sample")
+        self.last_counters = (self.last_progress, self.counters.read_counters())
+
+    def traffic_mbps(self, counters, now):
+        """
+        Get the ppp0 rx+tx rate since the previous check.
+
+        Returns:
+            float: The rate in Mbit/s, 0 if either reading is missing or the counters were reset.
+        """
+        if counters is None or self.last_counters is None or self.last_counters[1] is None:
+            return 0.0
+        last_time, last = self.last_counters
+        delta = sum(new - old for new, old in zip(counters, last))
+        return delta * 8 / max(now - last_time, 1e-6) / 1e6 if delta > 0 else 0.0
+
+    def recover(self, fault):
+        """
+        Run the next recovery step for a fault and record it.
+
+        Args:
+            fault (str): "at" or "link".
+        """
+        # A link fault starts with a re-dial instead of reopening the AT port
+        if fault == "link" and self.level == 0:
+            step = "redial"
+        else:
+            step = RecoverySteps[min(self.level, len(RecoverySteps) - 1)]
+        self.level += 1
+
+        print(f"{Module} {fault} fault, recovery step: {step}")
+        self.InstrumentData["Recovery_Active"] = True
+        start_time = time.monotonic()
+        try:
+            ok = getattr(self, f"step_{step}")()
+            # The modem dropped the data link, bring it back for the running test
+            if ok and step in ("cfun_toggle", "modem_reset") and self.InstrumentData.get("Link_Expected"):
+                ok = self.wait_registered() and self.step_redial()
+        finally:
+            self.InstrumentData["Recovery_Active"] = False
+
+        duration = round(time.monotonic() - start_time, 2)
+        print(f"{Module} {step} {'recovered' if ok else 'failed'} in {duration} s")
+        self.InstrumentData["Recovery_Log"].append({"fault": fault, "step": step, "duration_s": duration, "ok": ok})
+
+        if ok:
+            self.level = 0
+            self.failed_probes = 0
+            self.reset_progress()
+
+    def wait_for_at(self, timeout, reattach=False):
+        """
+        Probe the AT channel until it answers.
+
+        Args:
+            timeout (float): The time to wait in seconds.
+            reattach (bool): Reopen the port between probes, for a port that went away. Defaults to False.
+
+        Returns:
+            bool: True if it answered within timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self._stop_event.is_set():
+            if self.probe_at(timeout=1):
+                return True
+            time.sleep(1)
+            if reattach:
+                self.scheduler.reattach()
+        return False
+
+    def wait_registered(self, timeout=120):
+        """
+        Poll AT+CEREG? until the modem reports a home or roaming registration.
+
+        Current_Reg_Stat still holds the state from before the reset, so the
+        modem is asked directly instead of trusting it.
+        """
+        # dut_communication imports this module
+        from serialCOM.dut_communication import parse_cereg
+
+        self.InstrumentData["Current_Reg_Stat"] = -1
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and not self._stop_event.is_set():
+            error_code, response = self.at.send_command_and_read_response("AT+CEREG?\r\n", "", timeout=2)
+            registration = parse_cereg(response, query=True) if error_code == 0 else None
+            if registration is not None:
+                self.InstrumentData["Current_Reg_Stat"] = registration[0]
+                if registration[0] in (1, 5):
+                    return True
+            time.sleep(1)
+        return False
+
+    def step_reopen_port(self):
+        self.scheduler.reattach()
+        return self.wait_for_at(5)
+
+    def step_cfun_toggle(self):
+        self.at.send_command_and_read_response("AT+CFUN=0\r\n", "", timeout=15)
+        self.at.send_command_and_read_response("AT+CFUN=1\r\n", "", timeout=15)
+        return self.wait_for_at(10)
+
+    def step_modem_reset(self):
+        self.at.send_command_and_read_response("AT+CFUN=1,1\r\n", "", timeout=5)
+        # The module re-enumerates. The port watcher reattaches a moved AT port,
+        # one that comes back on the same path is reopened here
+        time.sleep(5)
+        if not self.wait_for_at(60, reattach=True):
+            return False
+        # Volatile settings are lost with the reset
+        for command in ("ATE0\r\n", "AT+CMEE=2\r\n", "AT+CEREG=2\r\n"):
+            self.at.send_command_and_read_response(command, "")
+        return True
+
+    def step_redial(self):
+        return redial_link(self.InstrumentData)
@@ -0,0 +1,349 @@
+import argparse
+import math
+import os
+import subprocess
+import threading
+import time
+from array import array
+
+Module = "[ResourceMonitor]"
+
+# Processes whose CPU use is tracked by default
+WatchedProcesses = ("pppd", "iperf3")
+
+# get_throttled bits that are active now
+ThrottleFlags = {
+    0: "under_voltage",
+    1: "arm_frequency_capped",
+    2: "throttled",
+    3: "soft_temperature_limit",
+}
+
+
+def read_cpu_times(path="/proc/stat"):
+    """
+    Read the busy and total jiffies of all CPUs and of every core.
+
+    Returns:
+        list: (busy, total) tuples, the aggregate first, then one per core.
+    """
+    times = []
+    with open(path) as f:
+        for line in f:
+            if not line.startswith("cpu"):
+                break
+            values = [int(value) for value in line.split()[1:]]
+            total = sum(values[:8])
+            # idle and iowait
+            times.append((total - values[3] - values[4], total))
+    return times
+
+
+def read_process_ticks(stat_path):
+    """
+    Read the utime + stime of a process or thread from its stat file.
+
+    Returns:
+        int: The CPU time in clock ticks, None if it is gone.
+    """
+    try:
+        with open(stat_path) as f:
+            # The command name may contain spaces, the fields follow the last ")"
+            fields = f.read().rpartition(")")[2].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ResourceMonitor:
+    """
+    Samples the load of the test bench itself while a test runs, so a result
+    limited by the Pi can be told apart from one limited by the network.
+
+    Every sample records the overall and busiest-core CPU use (/proc/stat),
+    the CPU use of pppd, iperf3 and this process (/proc/<pid>/stat), the SoC
+    temperature and the firmware throttling flags. Samples go into
+    preallocated arrays used as a ring buffer; the CPU time of this
+    process's threads is accumulated per thread name.
+
+    Args:
+        rate_hz (float): The sampling rate. Defaults to 1 Hz.
+        capacity (int): The number of samples kept. Defaults to 3600.
+        processes (tuple): The process names to track. Defaults to WatchedProcesses.
+        proc_root (str): The procfs mount point. Defaults to "/proc".
+        thermal_path (str): The SoC temperature in millidegrees. Defaults to thermal zone 0.
+        throttled_path (str): The firmware get_throttled attribute, "vcgencmd get_throttled" is used without it.
+    """
+    def __init__(self, rate_hz=1, capacity=3600, processes=WatchedProcesses, proc_root="/proc",
+                 thermal_path="/sys/class/thermal/thermal_zone0/temp",
+                 throttled_path="/sys/devices/platform/soc/soc:firmware/get_throttled"):
+        self.period = 1.0 / rate_hz
+        self.capacity = capacity
+        self.processes = tuple(processes)
+        self.proc_root = proc_root
+        self.thermal_path = thermal_path
+        self.throttled_path = throttled_path
+        self.use_vcgencmd = True
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+
+        self.times = array("d", bytes(8 * capacity))
+        self.cpu_pct = array("f", bytes(4 * capacity))
+        self.core_max_pct = array("f", bytes(4 * capacity))
+        self.temperature = array("f", bytes(4 * capacity))
+        self.throttled = array("L", bytes(array("L").itemsize * capacity))
+        # "self" is the test bench process
+        self.process_pct = {name: array("f", bytes(4 * capacity)) for name in self.processes + ("self",)}
+        self.count = 0
+
+        self.thread_cpu_s = {}
+        self.pids = {}
+        self.last_cpu = None
+        self.last_ticks = {}
+        self.last_thread_ticks = {}
+        self.last_time = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start sampling in a background thread.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ResourceMonitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            self.sample()
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                next_time = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def sample(self):
+        """
+        Take one sample. The first call only sets the baseline of the CPU counters.
+        """
+        now = time.monotonic()
+        try:
+            cpu = read_cpu_times(os.path.join(self.proc_root, "stat"))
+        except OSError:
+            return
+        ticks = {name: self._process_ticks(name) for name in self.process_pct}
+        thread_ticks = self._thread_ticks()
+
+        if self.last_cpu is not None:
+            elapsed = now - self.last_time
+            index = self.count % self.capacity
+            self.times[index] = now
+
+            usage = [self._busy_pct(old, new) for old, new in zip(self.last_cpu, cpu)]
+            self.cpu_pct[index] = usage[0]
+            self.core_max_pct[index] = max(usage[1:] or usage)
+            self.temperature[index] = self.read_temperature()
+            self.throttled[index] = self.read_throttled()
+
+            # Per process in percent of one core, like top
+            for name, value in ticks.items():
+                old = self.last_ticks.get(name)
+                delta = value - old if value is not None and old is not None and value >= old else 0
+                self.process_pct[name][index] = 100.0 * delta / self.clock_ticks / elapsed
+
+            for name, value in thread_ticks.items():
+                old = self.last_thread_ticks.get(name, value)
+                self.thread_cpu_s[name] = self.thread_cpu_s.get(name, 0.0) + max(0, value - old) / self.clock_ticks
+            self.count += 1
+
+        self.last_time = now
+        self.last_cpu = cpu
+        self.last_ticks = ticks
+        self.last_thread_ticks = thread_ticks
+
+    @staticmethod
+    def _busy_pct(old, new):
+        total = new[1] - old[1]
+        return 100.0 * (new[0] - old[0]) / total if total > 0 else 0.0
+
+    def _process_ticks(self, name):
+        """
+        Get the CPU ticks of all processes with a name, rescanning /proc when one of them ended.
+        """
+        if name == "self":
+            return read_process_ticks(os.path.join(self.proc_root, "self", "stat"))
+
+        pids = self.pids.get(name) or self._find_pids(name)
+        total = 0
+        for pid in pids:
+            value = read_process_ticks(os.path.join(self.proc_root, str(pid), "stat"))
+            if value is None:
+                # A restarted iperf3 gets a new pid. Ticks of the ended one are lost
+                self.pids[name] = self._find_pids(name)
+                return None
+            total += value
+        self.pids[name] = pids
+        return total if pids else None
+
+    def _find_pids(self, name):
+        pids = []
+        for entry in os.listdir(self.proc_root):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.proc_root, entry, "comm")) as f:
+                    if f.read().strip() == name:
+                        pids.append(int(entry))
+            except OSError:
+                continue
+        return pids
+
+    def _thread_ticks(self):
+        """
+        Get the CPU ticks of this process's threads, keyed by thread name.
+        """
+        names = {thread.native_id: thread.name for thread in threading.enumerate()}
+        task_dir = os.path.join(self.proc_root, "self", "task")
+        ticks = {}
+        try:
+            tids = os.listdir(task_dir)
+        except OSError:
+            return ticks
+        for tid in tids:
+            value = read_process_ticks(os.path.join(task_dir, tid, "stat"))
+            if value is not None:
+                name = names.get(int(tid), f"tid-{tid}")
+                ticks[name] = ticks.get(name, 0) + value
+        return ticks
+
+    def read_temperature(self):
+        """
+        Read the SoC temperature.
+
+        Returns:
+            float: The temperature in degrees Celsius, NaN if not available.
+        """
+        try:
+            with open(self.thermal_path) as f:
+                return int(f.read()) / 1000.0
+        except (OSError, ValueError):
+            return float("nan")
+
+    def read_throttled(self):
+        """
+        Read the firmware throttling flags, from sysfs or "vcgencmd get_throttled".
+
+        Returns:
+            int: The get_throttled bit field, 0 if not available.
+        """
+        try:
+            with open(self.throttled_path) as f:
+                return int(f.read().strip(), 16)
+        except (OSError, ValueError):
+            pass
+
+        if not self.use_vcgencmd:
+            return 0
+        try:
+            output = subprocess.run(["vcgencmd", "get_throttled"], capture_output=True, text=True, timeout=2).stdout
+            return int(output.strip().partition("=")[2], 16)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            # Not a Pi, do not try again
+            self.use_vcgencmd = False
+            return 0
+
+    def summary(self, start_time=None, end_time=None, saturation_pct=90, saturated_fraction=0.2, hot_celsius=80):
+        """
+        Summarise the samples between start_time and end_time and flag a limited bench.
+
+        A run is flagged "cpu_saturated" when the busiest core, or a tracked
+        process, was above saturation_pct for more than saturated_fraction of
+        the samples (iperf3 and pppd are single threaded, so one full core
+        already limits them). Any active get_throttled flag, and a temperature
+        at or above hot_celsius, is flagged as well.
+
+        Args:
+            start_time (float): The time.monotonic() start of the window. Defaults to None.
+            end_time (float): The time.monotonic() end of the window. Defaults to None.
+            saturation_pct (float): The busy percentage of a saturated core. Defaults to 90.
+            saturated_fraction (float): The share of saturated samples that flags a run. Defaults to 0.2.
+            hot_celsius (float): The temperature that flags a run. Defaults to 80.
+
+        Returns:
+            dict: CPU, process, thread, temperature and throttling figures and the flags. None without samples.
+        """
+        first = max(0, self.count - self.capacity)
+        indices = [n % self.capacity for n in range(first, self.count)
+                   if (start_time is None or self.times[n % self.capacity] >= start_time) and
+                   (end_time is None or self.times[n % self.capacity] <= end_time)]
+        if not indices:
+            return None
+
+        def mean(values):
+            return round(sum(values) / len(values), 1)
+
+        cpu = [self.cpu_pct[index] for index in indices]
+        core_max = [self.core_max_pct[index] for index in indices]
+        temperature = [self.temperature[index] for index in indices if not math.isnan(self.temperature[index])]
+        throttled = 0
+        for index in indices:
+            throttled |= self.throttled[index]
+
+        processes = {}
+        saturated = sum(1 for value in core_max if value >= saturation_pct)
+        for name, values in self.process_pct.items():
+            samples = [values[index] for index in indices]
+            processes[name] = {"mean_pct": mean(samples), "max_pct": round(max(samples), 1)}
+            saturated = max(saturated, sum(1 for value in samples if value >= saturation_pct))
+
+        flags = []
+        if saturated > saturated_fraction * len(indices):
+            flags.append("cpu_saturated")
+        flags += [name for bit, name in ThrottleFlags.items() if throttled & (1 << bit)]
+        if temperature and max(temperature) >= hot_celsius:
+            flags.append("hot")
+
+        return {
+            "samples": len(indices),
+            "cpu_mean_pct": mean(cpu),
+            "cpu_max_pct": round(max(cpu), 1),
+            "core_max_mean_pct": mean(core_max),
+            "saturated_samples": saturated,
+            "processes": processes,
+            "threads_cpu_s": {name: round(value, 2) for name, value in sorted(dict(self.thread_cpu_s).items())},
+            "temperature_max_c": round(max(temperature), 1) if temperature else None,
+            "throttled": hex(throttled),
+            "flags": flags,
+            "bench_limited": bool(flags),
+        }
+
+
+if __name__ == "__main__":
+    # Watch the bench load on its own, e.g. next to a manual iperf run
+    parser = argparse.ArgumentParser(description="Monitor the CPU, temperature and throttling of the test bench")
+    parser.add_argument("--rate", type=float, default=1, help="sampling rate in Hz")
+    parser.add_argument("--report", type=float, default=5, help="report interval in seconds")
+    args = parser.parse_args()
+
+    monitor = ResourceMonitor(rate_hz=args.rate)
+    monitor.start()
+    try:
+        while True:
+            report_start = time.monotonic()
+            time.sleep(args.report)
+            summary = monitor.summary(start_time=report_start)
+            if summary is not None:
+                print(f"{Module} cpu {summary['cpu_mean_pct']}% (busiest core {summary['core_max_mean_pct']}%), "
+                      f"{summary['processes']}, {summary['temperature_max_c']} C, throttled {summary['throttled']} {summary['flags']}")
+    except KeyboardInterrupt:
+        monitor.stop()
@@ -0,0 +1,379 @@
+import argparse
+import base64
+import gzip
+import json
+import math
+import random
+import struct
+import sys
+
+from Common.startupMetrics import timed_import
+
+Module = "[ResultCodec]"
+
+# Version of the encoded document layout, bumped on incompatible changes
+SchemaVersion = 1
+
+# Header: magic, schema version, serialiser, compression
+Magic = b"LTR"
+Header = struct.Struct("!3sBBB")
+ResultExtension = ".ltr"
+
+SERIALISER_MSGPACK = 1
+SERIALISER_CBOR = 2
+SERIALISER_JSON = 3
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSION_GZIP = 2
+
+# Numeric lists of at least this many values are stored as delta-encoded series
+MinSeriesLength = 4
+# Most decimal places tried to turn a float series into integers
+MaxDecimals = 6
+
+# Markers of the transformed containers, a series is {SeriesKey: [kind, decimals, data]}
+SeriesKey = "~s"
+TableKey = "~t"
+# Wraps a document dict whose only key is a marker, so it is not taken for a container
+EscapeKey = "~d"
+MarkerKeys = (SeriesKey, TableKey, EscapeKey)
+
+
+def optional_module(name):
+    """
+    Import an optional dependency.
+
+    Returns:
+        module: The module, None if it is not installed.
+    """
+    try:
+        return timed_import(name)
+    except ImportError:
+        return None
+
+
+def zigzag_varints(values):
+    """
+    Pack signed integers as zigzag LEB128 varints, small magnitudes take one byte.
+    """
+    out = bytearray()
+    for value in values:
+        value = value * 2 if value >= 0 else -value * 2 - 1
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def read_zigzag_varints(data):
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value >> 1 if not value & 1 else -(value >> 1) - 1)
+            value = shift = 0
+    return values
+
+
+def encode_series(values):
+    """
+    Delta-encode a list of numbers as integers, if that is lossless.
+
+    Floats are scaled by the fewest decimal places that reproduce every
+    value exactly.
+
+    Returns:
+        list: [kind, decimals, varint bytes], kind "i" (ints) or "f" (floats). None if not lossless.
+    """
+    if all(type(value) is int for value in values):
+        kind, decimals, integers = "i", 0, values
+    elif all(type(value) is float and math.isfinite(value) for value in values):
+        kind = "f"
+        for decimals in range(MaxDecimals + 1):
+            scale = 10 ** decimals
+            integers = [round(value * scale) for value in values]
+            # -0.0 would come back as 0.0
+            if all(integer / scale == value and (integer or math.copysign(1.0, value) > 0)
+                   for integer, value in zip(integers, values)):
+                break
+        else:
+            return None
+    else:
+        return None
+
+    deltas = [integers[0]] + [b - a for a, b in zip(integers, integers[1:])]
+    return [kind, decimals, zigzag_varints(deltas)]
+
+
+def decode_series(kind, decimals, data):
+    values = []
+    total = 0
+    for delta in read_zigzag_varints(data):
+        total += delta
+        values.append(total)
+    if kind == "f":
+        scale = 10 ** decimals
+        return [value / scale for value in values]
+    return values
+
+
+def pack(value):
+    """
+    Transform a result document: numeric lists become series, and lists of
+    dicts with the same keys become column tables.
+    """
+    if isinstance(value, dict):
+        packed = {key: pack(item) for key, item in value.items()}
+        if len(packed) == 1 and next(iter(packed)) in MarkerKeys:
+            return {EscapeKey: packed}
+        return packed
+    if isinstance(value, list):
+        if len(value) >= MinSeriesLength:
+            series = encode_series(value)
+            if series is not None:
+                return {SeriesKey: series}
+        if len(value) >= 2 and all(isinstance(item, dict) for item in value):
+            keys = list(value[0])
+            # Empty dicts have no column to carry the row count
+            if keys and all(list(item) == keys for item in value):
+                return {TableKey: [keys, [pack([item[key] for item in value]) for key in keys]]}
+        return [pack(item) for item in value]
+    return value
+
+
+def unpack(value):
+    """
+    Reverse pack().
+    """
+    if isinstance(value, dict):
+        if EscapeKey in value and len(value) == 1:
+            return {key: unpack(item) for key, item in value[EscapeKey].items()}
+        if SeriesKey in value and len(value) == 1:
+            kind, decimals, data = value[SeriesKey]
+            if isinstance(data, str):
+                data = base64.b64decode(data)
+            return decode_series(kind, decimals, data)
+        if TableKey in value and len(value) == 1:
+            keys, columns = value[TableKey]
+            columns = [unpack(column) for column in columns]
+            return [dict(zip(keys, row)) for row in zip(*columns)]
+        return {key: unpack(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unpack(item) for item in value]
+    return value
+
+
+def to_json_safe(value):
+    """
+    Base64 the series bytes for the JSON serialiser.
+    """
+    if isinstance(value, dict):
+        if EscapeKey in value and len(value) == 1:
+            return {EscapeKey: {key: to_json_safe(item) for key, item in value[EscapeKey].items()}}
+        if SeriesKey in value and len(value) == 1:
+            kind, decimals, data = value[SeriesKey]
+            return {SeriesKey: [kind, decimals, base64.b64encode(data).decode()]}
+        return {key: to_json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_json_safe(item) for item in value]
+    return value
+
+
+def serialise(document, serialiser=None):
+    """
+    Serialise with msgpack, else cbor2, else compact JSON.
+
+    Returns:
+        int: The serialiser used.
+        bytes: The serialised document.
+    """
+    if serialiser in (None, SERIALISER_MSGPACK):
+        msgpack = optional_module("msgpack")
+        if msgpack is not None:
+            return SERIALISER_MSGPACK, msgpack.packb(document, use_bin_type=True)
+    if serialiser in (None, SERIALISER_CBOR):
+        cbor2 = optional_module("cbor2")
+        if cbor2 is not None:
+            return SERIALISER_CBOR, cbor2.dumps(document)
+    return SERIALISER_JSON, json.dumps(to_json_safe(document), separators=(",", ":")).encode()
+
+
+def deserialise(serialiser, payload):
+    if serialiser == SERIALISER_MSGPACK:
+        return timed_import("msgpack").unpackb(payload, raw=False, strict_map_key=False)
+    if serialiser == SERIALISER_CBOR:
+        return timed_import("cbor2").loads(payload)
+    if serialiser == SERIALISER_JSON:
+        return json.loads(payload)
+    raise ValueError(f"Unknown serialiser {serialiser}")
+
+
+def compress(payload, compression=None):
+    """
+    Compress with zstd, else gzip.
+
+    Returns:
+        int: The compression used.
+        bytes: The compressed payload.
+    """
+    if compression in (None, COMPRESSION_ZSTD):
+        zstandard = optional_module("zstandard")
+        if zstandard is not None:
+            return COMPRESSION_ZSTD, zstandard.ZstdCompressor(level=19).compress(payload)
+    if compression == COMPRESSION_NONE:
+        return COMPRESSION_NONE, payload
+    # mtime=0 keeps the output identical for identical documents
+    return COMPRESSION_GZIP, gzip.compress(payload, compresslevel=9, mtime=0)
+
+
+def decompress(compression, payload):
+    if compression == COMPRESSION_ZSTD:
+        return timed_import("zstandard").ZstdDecompressor().decompress(payload)
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(payload)
+    if compression == COMPRESSION_NONE:
+        return payload
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def encode_result(document, serialiser=None, compression=None):
+    """
+    Encode a result document for upload.
+
+    Args:
+        document (dict): The output_data document, JSON types only.
+        serialiser (int): Force a serialiser. Defaults to the best installed one.
+        compression (int): Force a compression. Defaults to the best installed one.
+
+    Returns:
+        bytes: The header followed by the compressed, serialised document.
+    """
+    serialiser, payload = serialise(pack(document), serialiser)
+    compression, payload = compress(payload, compression)
+    return Header.pack(Magic, SchemaVersion, serialiser, compression) + payload
+
+
+def decode_result(data):
+    """
+    Decode an encoded result, or a plain JSON one uploaded before the codec existed.
+
+    Args:
+        data (bytes): The object contents.
+
+    Returns:
+        dict: The result document, equal to the one encoded.
+
+    Raises:
+        ValueError: The data is not a valid result, including errors of the
+            decompressor and deserialiser (e.g. zstandard.ZstdError).
+    """
+    if not data.startswith(Magic):
+        return json.loads(data)
+    if len(data) < Header.size:
+        raise ValueError("Truncated result header")
+
+    magic, version, serialiser, compression = Header.unpack_from(data)
+    if version > SchemaVersion:
+        raise ValueError(f"Result schema version {version} is newer than {SchemaVersion}")
+    try:
+        return unpack(deserialise(serialiser, decompress(compression, data[Header.size:])))
+    except ValueError:
+        raise
+    except Exception as e:
+        # The optional codecs raise their own exception types
+        raise ValueError(f"Corrupt result payload: {type(e).__name__}: {e}") from e
+
+
+def synthetic_result(duration=600, seed=1):
+    """
+    Build a result document shaped like a real run, for the size benchmark.
+    """
+    rng = random.Random(seed)
+    intervals = [round(max(0.0, 12 + rng.gauss(0, 3)), 3) for _ in range(duration)]
+    return {
+        "SIM ICCID": "89440000000000000001", "SIM IMSI": "234150000000001", "FW Version": "EC25EFAR06A06M4G",
+        "IMEI": "860000000000001", "Signal Quality": 21, "Network": '"Operator"', "Network Tracking Area": '"1A2B"',
+        "Network Cell ID": '"0123ABC"', "Access Technology": 7, "Test Time": '"26/10/01,10:00:00+04"',
+        "Throughput": f"{sum(intervals) / duration:.2f} Mbits/sec", "Out of Coverage Count": 1,
+        "Latency Idle": {"samples": 50, "lost": 0, "loss_pct": 0.0, "min_ms": 31.2, "p50_ms": 38.4, "p95_ms": 52.1, "p99_ms": 61.0, "max_ms": 70.3},
+        "Latency Loaded": {"samples": 2990, "lost": 10, "loss_pct": 0.33, "min_ms": 35.0, "p50_ms": 96.2, "p95_ms": 210.5, "p99_ms": 402.1, "max_ms": 811.0},
+        "Registration Timeline": [{"t_s": 0.0, "stat": 2, "state": "searching"}, {"t_s": 4.213, "stat": 1, "state": "registered"}],
+        "Recovery Log": [{"fault": "link", "step": "redial", "duration_s": 6.12, "ok": True}],
+        "Throughput Intervals": intervals,
+        "Throughput Coverage": [1] * (duration - 5) + [0] * 5,
+    }
+
+
+def benchmark(document):
+    """
+    Compare the size of a document as uploaded before (json.dumps, default separators)
+    with gzip'd JSON and every available encoding.
+
+    Returns:
+        list: (name, bytes, reduction factor) rows.
+    """
+    upload = json.dumps(document).encode()
+    baseline = len(upload)
+    rows = [("json upload", baseline, 1.0)]
+    compact = len(json.dumps(document, separators=(",", ":")).encode())
+    rows.append(("compact json", compact, baseline / compact))
+    gzipped = len(gzip.compress(upload, compresslevel=9, mtime=0))
+    rows.append(("gzip json", gzipped, baseline / gzipped))
+    serialisers = {SERIALISER_MSGPACK: "msgpack", SERIALISER_CBOR: "cbor", SERIALISER_JSON: "json"}
+    compressions = {COMPRESSION_NONE: "none", COMPRESSION_ZSTD: "zstd", COMPRESSION_GZIP: "gzip"}
+    seen = set()
+    for serialiser in (SERIALISER_MSGPACK, SERIALISER_CBOR, SERIALISER_JSON):
+        for compression in (COMPRESSION_ZSTD, COMPRESSION_GZIP, COMPRESSION_NONE):
+            encoded = encode_result(document, serialiser, compression)
+            used = Header.unpack_from(encoded)[2:]
+            if used in seen:
+                continue
+            seen.add(used)
+            name = f"ltr {serialisers[used[0]]}+{compressions[used[1]]}"
+            if decode_result(encoded) != document:
+                raise AssertionError(f"{name} is not lossless")
+            rows.append((name, len(encoded), baseline / len(encoded)))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode, decode and benchmark test result documents")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="print an encoded (or JSON) result as JSON")
+    export.add_argument("file")
+
+    encode = subparsers.add_parser("encode", help="encode a JSON result")
+    encode.add_argument("file")
+    encode.add_argument("output")
+
+    bench = subparsers.add_parser("bench", help="compare the encoded size with the JSON upload")
+    bench.add_argument("files", nargs="*", help="result files, a synthetic 600 s run if none")
+    bench.add_argument("--duration", type=int, default=600, help="duration of the synthetic run in seconds")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        with open(args.file, "rb") as f:
+            json.dump(decode_result(f.read()), sys.stdout, indent=4)
+        print()
+    elif args.command == "encode":
+        with open(args.file, "rb") as f:
+            encoded = encode_result(decode_result(f.read()))
+        with open(args.output, "wb") as f:
+            f.write(encoded)
+        print(f"{Module} {args.output}: {len(encoded)} bytes")
+    else:
+        documents = []
+        for name in args.files:
+            with open(name, "rb") as f:
+                documents.append((name, decode_result(f.read())))
+        if not documents:
+            documents.append((f"synthetic {args.duration} s run", synthetic_result(args.duration)))
+        for name, document in documents:
+            print(f"{Module} {name}")
+            for encoding, size, factor in benchmark(document):
+                print(f"  {encoding:<20} {size:>8} bytes  {factor:6.1f}x")
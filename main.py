@@ -1,23 +1,38 @@
+import time
+StartupTime = time.perf_counter()
+
 import json
+import os
 import re
 import threading
-import time
 import queue
-import boto3
-import json
+from Common.startupMetrics import StartupMetrics, record_metric, timed_import
 from serialCOM.serial_communication import SerialCommunication
 from serialCOM.dut_communication import handle_dut_commands
 from DataCommunication.dataOverDialup import dialupTask
+from DataCommunication.bandMatrix import bandMatrixTask, load_matrix, DefaultMatrix, BandMatrixEnv
 from Display.LcdLib import DisplayTask
+from serialCOM.port_discovery import wait_for_modem, PortWatcher
+from Reporting.resultCodec import encode_result, ResultExtension
+record_metric("imports_s", StartupTime)
+
+# Fallback ports when no known modem is discovered
 ATComport = '/dev/ttyUSB2'
 DialupComport = '/dev/ttyUSB3'
 
+# Ports of the modem under test, updated by discovery and on re-enumeration
+ModemPorts = {"at": ATComport, "ppp": DialupComport}
+# Seconds between the ports appearing and the first AT command
+ModemSettleTime = 10
+
 InstrumentData = {}
 messagesQueue = {
 }
 
 messagesQueue['Dialup'] = queue.Queue()
 messagesQueue['Display'] = queue.Queue()
+messagesQueue['AT'] = queue.Queue()
+messagesQueue['Registration'] = queue.Queue()
 
 def handle_serial_display():
     """
@@ -40,9 +55,23 @@ def handle_dialup_commands():
         print('[Main] Module registered. Starting dialup in 5 seconds')
         InstrumentData["Running_Task"] = "Starting Dialup"
         time.sleep(5)
-        dialupTask(InstrumentData, DialupComport, messagesQueue)
+
+        # A matrix file in TESTBENCH_BAND_MATRIX ("default" for the built-in one) replaces the single test
+        matrixPath = os.environ.get(BandMatrixEnv)
+        if matrixPath:
+            entries = DefaultMatrix if matrixPath == "default" else load_matrix(matrixPath)
+            bandMatrixTask(InstrumentData, messagesQueue['AT'].get(), entries)
+        else:
+            dialupTask(InstrumentData, ModemPorts["ppp"], messagesQueue)
     return
 
+def update_ports(ports):
+    """
+    Function to record the ports of a re-enumerated modem, so the next dial-up uses its PPP port.
+    """
+    ModemPorts.update(ports)
+    InstrumentData["Dialup_Port"] = ModemPorts["ppp"]
+
 def handle_at_commands():
     """
     Function will communicate with DUT over AT interface
@@ -50,9 +79,27 @@ def handle_at_commands():
     the registeration state of the device and will keep signal quality
     in check as well
     """
-    # wait for 90 seconds for module USB interface to be ready on reboot
-    time.sleep(90)
-    handle_dut_commands(InstrumentData, ATComport, messagesQueue)
+    # wait up to 90 seconds for module USB interface to be ready on reboot
+    modem = wait_for_modem(timeout=90)
+    if modem is None:
+        print(f"[Main] No known modem discovered. Using {ModemPorts}")
+        handle_dut_commands(InstrumentData, ModemPorts["at"], messagesQueue)
+        return
+
+    ModemPorts.update(modem["ports"])
+    InstrumentData["Dialup_Port"] = ModemPorts["ppp"]
+    print(f"[Main] Found {modem['model']} on USB {modem['usb_path']}: {modem['ports']}")
+    InstrumentData["Modem_Model"] = modem["model"]
+
+    # Follow the modem across resets so open sessions can reattach
+    portWatcher = PortWatcher(modem)
+    portWatcher.add_listener(lambda current: update_ports(current["ports"]) if current else None)
+    portWatcher.start()
+
+    # The AT port enumerates before the module firmware accepts commands
+    time.sleep(ModemSettleTime)
+    handle_dut_commands(InstrumentData, ModemPorts["at"], messagesQueue, port_watcher=portWatcher)
+    portWatcher.stop()
     return
 
 def write_to_s3(output_data, bucket_name, file_name):
@@ -67,6 +114,9 @@ def write_to_s3(output_data, bucket_name, file_name):
     Returns:
         str: A message indicating the success or failure of the operation.
     """
+    # boto3 takes seconds to import on a Pi, only load it for the upload
+    boto3 = timed_import("boto3")
+
     # Create a session using your AWS credentials
     s3 = boto3.resource(
         's3',
@@ -75,12 +125,13 @@ def write_to_s3(output_data, bucket_name, file_name):
         region_name='xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
     )
 
-    # Convert the output_data to JSON
-    output_json = json.dumps(output_data)
+    # Encode the output_data compactly, the upload goes over the metered LTE link
+    output_encoded = encode_result(output_data)
+    print(f"[Main] Result encoded to {len(output_encoded)} bytes ({len(json.dumps(output_data))} as JSON)")
 
     try:
-        # Write the JSON data to the S3 bucket
-        s3.Object(bucket_name, file_name).put(Body=output_json)
+        # Write the encoded data to the S3 bucket
+        s3.Object(bucket_name, file_name).put(Body=output_encoded, ContentType="application/octet-stream")
         return "Success: Data written to S3 bucket."
     except Exception as e:
         return f"Error: {str(e)}"
@@ -100,6 +151,8 @@ if __name__ == "__main__":
     display_thread.start()
     at_thread.start()
     dialup_thread.start()
+    record_metric("startup_s", StartupTime)
+    print(f"[Main] Startup metrics: {StartupMetrics}")
     
     
     # Join the threads to wait for their completion
@@ -120,9 +173,23 @@ if __name__ == "__main__":
         "Network": InstrumentData["cops_oper"],
         "Network Tracking Area": InstrumentData["Current_Tac"],
         "Network Cell ID": InstrumentData["Current_Ci"],
+        "Access Technology": InstrumentData.get("cereg_act"),
         "Test Time": InstrumentData["cclk"],
-        "Throughput": InstrumentData["Final_Result"],
+        "Throughput": InstrumentData.get("Final_Result"),
         "Out of Coverage Count": InstrumentData["OOC_count"],
+        "Latency Idle": InstrumentData.get("Latency_Idle"),
+        "Latency Loaded": InstrumentData.get("Latency_Loaded"),
+        "Interface Throughput": InstrumentData.get("Interface_Throughput"),
+        "Resource Usage": InstrumentData.get("Resource_Usage"),
+        "Startup Metrics": StartupMetrics,
+        "AT Port Stats": InstrumentData.get("AT_Scheduler_Stats"),
+        "Registration Timeline": InstrumentData.get("Registration_Timeline", []),
+        "Recovery Log": InstrumentData.get("Recovery_Log", []),
+        "Throughput Intervals": InstrumentData.get("Throughput_Intervals", []),
+        "Throughput Coverage": InstrumentData.get("Throughput_Coverage", []),
+        "Coverage": InstrumentData.get("Coverage"),
+        "Multi Server": InstrumentData.get("Multi_Server"),
+        "Band Matrix": InstrumentData.get("Band_Matrix"),
     }
 
     print(json.dumps(output_data, indent=4))
@@ -131,7 +198,7 @@ if __name__ == "__main__":
     # Replace the slashes and comma with nothing, and the hyphen with an underscore
     formatted_time = outputTime.replace('/', '').replace(',', '_').replace('-', '_').replace(':', '').replace('+', '_')
     simICCId = output_data["SIM ICCID"]
-    fileName = f"{simICCId}_{formatted_time}.json"
+    fileName = f"{simICCId}_{formatted_time}{ResultExtension}"
 
     ret = write_to_s3(output_data, 'lte-performance-results', fileName)
     print(ret)  # Output: Success: Data written to S3 bucket.
@@ -0,0 +1,530 @@
+import itertools
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+Module = "[AT_SCHED]"
+
+# Client priorities, lower value is served first
+PRIORITY_URGENT = 0      # health checks and recovery
+PRIORITY_CONTROL = 1     # DUT initialisation and registration
+PRIORITY_MONITOR = 2     # KPI sampling
+PRIORITY_BACKGROUND = 3  # display and other best-effort queries
+
+# Identity queries whose answers only change with the modem or the SIM
+StaticCommands = {
+    "AT+CGSN": "modem",
+    "AT+CGMR": "modem",
+    "AT+CIMI": "sim",
+    "AT+QCCID": "sim",
+}
+
+# URCs after which the SIM (or the whole modem) may have changed
+SimChangeUrcs = ("+CPIN:", "+QUSIM:", "+QSIMSTAT:")
+ModemRestartUrcs = ("RDY",)
+
+# Extra time a caller waits beyond the command timeout, for the time queued behind other commands
+WaitMargin = 30
+
+FinalResultPattern = re.compile(r"^(OK|ERROR|NO CARRIER|\+CME ERROR:.*|\+CMS ERROR:.*)$")
+
+
+def response_prefix(command):
+    """
+    Get the information response prefix of an AT command.
+
+    Args:
+        command (str): The AT command, e.g. "AT+CEREG?"
+
+    Returns:
+        str: The response prefix, e.g. "+CEREG", None for basic commands.
+    """
+    match = re.match(r"AT([+$^][A-Z0-9]+)", command.strip().upper())
+    return match.group(1) if match else None
+
+
+def is_query(command):
+    """
+    Check whether a command only reads state, so identical ones can share one answer.
+    """
+    command = command.strip()
+    return command.endswith("?") or "=" not in command
+
+
+class StaticValueCache:
+    """
+    Caches the answers of the static identity queries, persisted per AT port and IMEI.
+
+    Args:
+        path (str): The JSON file the cache is persisted to. None keeps it in memory only.
+        port (str): The AT port the cache belongs to.
+
+    Attributes:
+        verified (bool): Whether the persisted entries were checked against the live IMEI/ICCID.
+    """
+    def __init__(self, path, port):
+        self.path = path
+        self.port = port
+        self.verified = False
+        self.store = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.store = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"{Module} Ignoring unreadable cache {path}: {e}")
+        self.entry = self.store.get(port, {"imei": None, "iccid": None, "responses": {}})
+
+    def get(self, command):
+        """
+        Get a cached answer.
+
+        Returns:
+            str: The cached response, None if not cached (or not verified yet).
+        """
+        if not self.verified:
+            return None
+        return self.entry["responses"].get(command)
+
+    def put(self, command, response):
+        """
+        Cache the answer of a static query.
+        """
+        self.entry["responses"][command] = response
+        self.save()
+
+    def bind_identity(self, imei, iccid):
+        """
+        Check the persisted entry against the live modem and SIM identity,
+        dropping whatever belongs to another modem or SIM.
+
+        Args:
+            imei (str): The live IMEI, None if unknown.
+            iccid (str): The live ICCID, None if no SIM.
+        """
+        responses = self.entry["responses"]
+        if imei is None or imei != self.entry["imei"]:
+            responses.clear()
+        elif iccid is None or iccid != self.entry["iccid"]:
+            self.invalidate("sim")
+
+        self.entry["imei"] = imei
+        self.entry["iccid"] = iccid
+        self.verified = imei is not None
+        self.save()
+
+    def invalidate(self, kind=None):
+        """
+        Drop cached answers.
+
+        Args:
+            kind (str): "sim" or "modem" to drop only those answers. Defaults to all.
+        """
+        responses = self.entry["responses"]
+        for command in list(responses):
+            if kind is None or StaticCommands.get(command) == kind:
+                del responses[command]
+        if kind in (None, "sim"):
+            self.entry["iccid"] = None
+
+    def save(self):
+        """
+        Persist the cache, replacing the file atomically.
+        """
+        if not self.path:
+            return
+        self.store[self.port] = self.entry
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.store, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"{Module} Unable to persist cache {self.path}: {e}")
+
+
+class ATRequest:
+    """
+    One AT command waiting for (or holding) its response.
+
+    Attributes:
+        command (str): The command, without line ending.
+        timeout (float): The time to wait for the final result code.
+        result (tuple): (error code, response) once completed.
+    """
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.result = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def complete(self, error_code, response):
+        """
+        Set the result. Only the first completion counts.
+        """
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.result = (error_code, response)
+            self.done.set()
+
+    def wait(self):
+        """
+        Wait for the result.
+
+        Returns:
+            tuple: (error code, response), (-1, "") if it did not complete in time.
+        """
+        if not self.done.wait(self.timeout + WaitMargin):
+            # Completed here, so the scheduler skips it if it is still queued
+            self.complete(-1, "")
+        return self.result
+
+
+class ATClient:
+    """
+    A client of the scheduler. Offers the same command methods as
+    SerialCommunication, with all commands queued at the client's priority.
+
+    Args:
+        scheduler (ATCommandScheduler): The scheduler owning the AT port.
+        name (str): The client name, used for logging.
+        priority (int): The priority of the client's commands.
+    """
+    def __init__(self, scheduler, name, priority):
+        self.scheduler = scheduler
+        self.name = name
+        self.priority = priority
+
+    def send_command_and_read_response(self, command, response=None, timeout=5):
+        """
+        Sends a command and waits for its final result code.
+
+        Returns:
+            int: An error code. 0 if a final result code was received, -1 otherwise.
+            str: The response
+        """
+        return self.scheduler.submit(command, self.priority, timeout).wait()
+
+    def send_command_and_wait_for_string(self, command, response=None, expected_response=None, timeout=1):
+        """
+        Sends a command and checks the response for a specific string.
+
+        Returns:
+            int: An error code. 0 only if the expected response is received, -1 otherwise.
+            str: The response
+        """
+        error_code, response = self.scheduler.submit(command, self.priority, max(timeout, 5)).wait()
+        if expected_response is None or expected_response not in response:
+            error_code = -1
+        return error_code, response
+
+
+class ATCommandScheduler:
+    """
+    Owns the AT channel and serialises every AT consumer on it.
+
+    Commands are served by priority and in order of submission within a
+    priority. Identical queries already waiting or in flight are coalesced
+    into one transaction, answers of the static identity queries are served
+    from a StaticValueCache, and unsolicited result codes are read and
+    dispatched to their subscribers whenever the channel is idle (and between
+    the lines of a command response).
+
+    Args:
+        ser_comm_obj (SerialCommunication): The opened AT port.
+        cache_path (str): The file the static values are persisted to. Defaults to None.
+        idle_poll (float): The read timeout while idle, bounds the time a new command waits. Defaults to 0.05 s.
+
+    Attributes:
+        stats (dict): Counters of port traffic, coalesced queries and cache hits.
+    """
+    def __init__(self, ser_comm_obj, cache_path=None, idle_poll=0.05):
+        self.ser = ser_comm_obj
+        self.idle_poll = idle_poll
+        self.cache = StaticValueCache(cache_path, ser_comm_obj.serial_port)
+        self.requests = queue.PriorityQueue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.urc_handlers = []
+        self.partial_line = ""
+        self.reattach_port = None
+        self.running = False
+        self.thread = None
+        self.active = None
+        self.stats = {"commands_sent": 0, "coalesced": 0, "cache_hits": 0, "timeouts": 0, "urcs": 0}
+
+    def client(self, name, priority=PRIORITY_BACKGROUND):
+        """
+        Create a client of the scheduler.
+
+        Returns:
+            ATClient: The client.
+        """
+        return ATClient(self, name, priority)
+
+    def subscribe_urc(self, prefix, callback):
+        """
+        Subscribe to an unsolicited result code.
+
+        The callback runs on the scheduler thread and must not send AT commands.
+
+        Args:
+            prefix (str): The URC prefix, e.g. "+CEREG".
+            callback (callable): Called with the URC line.
+        """
+        self.urc_handlers.append((prefix, callback))
+
+    def unsubscribe_urc(self, prefix, callback):
+        """
+        Remove a subscription made with subscribe_urc().
+        """
+        # Rebinding keeps a dispatch running on the scheduler thread safe
+        self.urc_handlers = [handler for handler in self.urc_handlers if handler != (prefix, callback)]
+
+    def start(self):
+        """
+        Start serving commands.
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop serving commands. Commands still waiting complete with an error.
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._fail_waiting()
+
+    def _fail_waiting(self):
+        """
+        Complete every queued and in-flight request with an error.
+        """
+        with self.lock:
+            self.running = False
+            while True:
+                try:
+                    _, _, request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                request.complete(-1, "")
+            for request in self.pending.values():
+                request.complete(-1, "")
+            self.pending.clear()
+            if self.active is not None:
+                self.active.complete(-1, "")
+                self.active = None
+
+    def reattach(self, serial_port=None):
+        """
+        Reopen the AT port, e.g. after the modem re-enumerated.
+
+        The port is reopened by the scheduler thread before the next command.
+
+        Args:
+            serial_port (str): The new AT port. Defaults to the current one.
+        """
+        # Never override a pending reattach to a new port with the old one
+        self.reattach_port = serial_port or self.reattach_port or self.ser.serial_port
+
+    def submit(self, command, priority=PRIORITY_BACKGROUND, timeout=5):
+        """
+        Queue a command.
+
+        Args:
+            command (str): The AT command, line ending optional.
+            priority (int): The priority of the command.
+            timeout (float): The time to wait for the final result code.
+
+        Returns:
+            ATRequest: The request, wait() on it for (error code, response).
+        """
+        command = command.strip()
+
+        cached = self.cache.get(command)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            request = ATRequest(command, timeout)
+            request.complete(0, cached)
+            return request
+
+        with self.lock:
+            if not self.running:
+                request = ATRequest(command, timeout)
+                request.complete(-1, "")
+                return request
+
+            request = self.pending.get(command) if is_query(command) else None
+            # A request its callers gave up on is not shared
+            if request is not None and request.done.is_set():
+                request = None
+            if request is not None:
+                self.stats["coalesced"] += 1
+            else:
+                request = ATRequest(command, timeout)
+                if is_query(command):
+                    self.pending[command] = request
+            # A coalesced request is queued again so it is served at the best waiting priority
+            self.requests.put((priority, next(self.sequence), request))
+        return request
+
+    def _run(self):
+        try:
+            self._serve()
+        finally:
+            # Also when serving failed, so no caller waits for a command that is never sent
+            self._fail_waiting()
+
+    def _serve(self):
+        while self.running:
+            if self.reattach_port is not None:
+                self._reopen()
+
+            try:
+                _, _, request = self.requests.get_nowait()
+            except queue.Empty:
+                line = self._read_line(self.idle_poll)
+                if line is None:
+                    # Port is gone, wait for a reattach instead of spinning
+                    time.sleep(self.idle_poll)
+                elif line:
+                    self._dispatch_urc(line)
+                continue
+
+            if request.done.is_set():
+                continue
+
+            if request.command in StaticCommands and not self.cache.verified:
+                self._verify_cache()
+                cached = self.cache.get(request.command)
+                if cached is not None:
+                    self.stats["cache_hits"] += 1
+                    self._finish(request, 0, cached)
+                    continue
+
+            self.active = request
+            error_code, response = self._execute(request.command, request.timeout)
+            if error_code == 0 and request.command in StaticCommands and "OK" in response:
+                self.cache.put(request.command, response)
+            self._finish(request, error_code, response)
+            self.active = None
+
+    def _reopen(self):
+        serial_port, self.reattach_port = self.reattach_port, None
+        print(f"{Module} Reattaching AT channel on {serial_port}")
+        if self.ser.ser is not None and self.ser.ser.is_open:
+            self.ser.close_connection()
+        self.ser.serial_port = serial_port
+        self.ser.open_connection()
+        self.partial_line = ""
+        # The modem may have been swapped or its SIM changed while detached
+        self.cache.verified = False
+
+    def _finish(self, request, error_code, response):
+        with self.lock:
+            if self.pending.get(request.command) is request:
+                del self.pending[request.command]
+        request.complete(error_code, response)
+
+    def _verify_cache(self):
+        """
+        Read the live IMEI and ICCID so the persisted static values can be trusted.
+        """
+        imei_code, imei_response = self._execute("AT+CGSN", 5)
+        match = re.search(r"^(\d{14,17})\s*$", imei_response, re.MULTILINE)
+        imei = match.group(1) if match else None
+
+        iccid_code, iccid_response = self._execute("AT+QCCID", 5)
+        match = re.search(r"\+QCCID: (\w+)", iccid_response)
+        iccid = match.group(1) if match else None
+
+        self.cache.bind_identity(imei, iccid)
+        if imei is not None:
+            self.cache.put("AT+CGSN", imei_response)
+        if iccid is not None:
+            self.cache.put("AT+QCCID", iccid_response)
+
+    def _execute(self, command, timeout):
+        """
+        Run one AT transaction on the port.
+
+        Returns:
+            int: An error code. 0 if a final result code was received, -1 otherwise.
+            str: The response
+        """
+        self.stats["commands_sent"] += 1
+        if self.ser.write_command(command + "\r\n") != 0:
+            return -1, ""
+
+        prefix = response_prefix(command)
+        response = ""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            line = self._read_line(min(0.5, max(0.01, deadline - time.time())))
+            if line is None:
+                return -1, response
+            if not line:
+                continue
+
+            text = line.strip()
+            if self._is_urc(text, prefix):
+                self._dispatch_urc(line)
+                continue
+
+            response += line
+            if FinalResultPattern.match(text):
+                if self.ser.enable_logging:
+                    print(self.ser.get_formatted_time(), response)
+                return 0, response
+
+        self.stats["timeouts"] += 1
+        print(f"{Module} {command} timed out")
+        return -1, response
+
+    def _read_line(self, timeout):
+        """
+        Read one complete line, keeping partial lines until they are completed.
+
+        Returns:
+            str: The line, "" if no complete line arrived, None on port error.
+        """
+        error_code, data = self.ser.read_line(timeout)
+        if error_code != 0:
+            return None
+
+        self.partial_line += data
+        if not self.partial_line.endswith("\n"):
+            return ""
+
+        line, self.partial_line = self.partial_line, ""
+        return line if line.strip() else ""
+
+    def _is_urc(self, text, prefix):
+        # A line carrying the prefix of the command in flight is its response
+        if prefix is not None and text.startswith(prefix + ":"):
+            return False
+        return any(text.startswith(urc) for urc, _ in self.urc_handlers) or \
+            text.startswith(SimChangeUrcs) or text in ModemRestartUrcs
+
+    def _dispatch_urc(self, line):
+        text = line.strip()
+        self.stats["urcs"] += 1
+        if self.ser.enable_logging:
+            print(self.ser.get_formatted_time(), text)
+
+        if text.startswith(SimChangeUrcs) or text in ModemRestartUrcs:
+            # Re-check IMEI and ICCID before the next static answer is served
+            self.cache.verified = False
+
+        for urc, callback in self.urc_handlers:
+            if text.startswith(urc):
+                callback(line)
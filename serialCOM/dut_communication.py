@@ -1,11 +1,60 @@
 import re
 import json
 import time
+import queue
 from serialCOM.serial_communication import SerialCommunication
+from serialCOM.at_scheduler import ATCommandScheduler, PRIORITY_CONTROL
+from Monitoring.healthWatchdog import HealthWatchdog
 
 Module = "[DUT_COMM]"
 
-def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=921600, timeout=5, enable_logging=True):
+# Persisted answers of the static identity queries (IMEI, ICCID, IMSI, firmware)
+ATCachePath = "/var/tmp/lte_testbench_at_cache.json"
+
+# Seconds between fallback AT+CEREG? queries while waiting for registration URCs
+RegistrationQueryInterval = 10
+
+RegistrationStates = {
+    0: "not searching",
+    1: "registered",
+    2: "searching",
+    3: "denied",
+    4: "unknown",
+    5: "roaming",
+}
+
+def parse_cereg(response, query=False):
+    """
+    Parse the last +CEREG line of a query response or URC (with AT+CEREG=2).
+
+    The query response carries <n> before <stat>: "+CEREG: 2,1,<tac>,<ci>,<act>"
+    or "+CEREG: 2,2". The URC does not: "+CEREG: 1,<tac>,<ci>,<act>" or "+CEREG: 2".
+    <act> is optional in both, so the caller tells which one it has.
+
+    Args:
+        response (str): The query response or URC.
+        query (bool): True for an AT+CEREG? response, False for a URC. Defaults to False.
+
+    Returns:
+        tuple: (stat, tac, ci, act), tac/ci None when not reported and act -1 when not reported.
+            None if there is no +CEREG line.
+    """
+    lines = re.findall(r"\+CEREG: ([^\r\n]+)", response)
+    if not lines:
+        return None
+
+    fields = [field.strip() for field in lines[-1].split(",")]
+    if query:
+        fields = fields[1:]
+    if not fields or not fields[0].isdigit():
+        return None
+
+    tac, ci = (fields[1], fields[2]) if len(fields) >= 3 else (None, None)
+    act = int(fields[3]) if len(fields) >= 4 and fields[3].isdigit() else -1
+    return int(fields[0]), tac, ci, act
+
+
+def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=921600, timeout=5, enable_logging=True, cache_path=ATCachePath, port_watcher=None):
 
     # Entries for internal states
     InstrumentData["Current_Reg_Stat"] = -1
@@ -18,7 +67,22 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
     """
     Function to handle AT commands.
     """
-    ser_comm_obj = SerialCommunication(serial_port=ATComport, baud_rate=baud_rate, timeout=timeout, enable_logging=enable_logging)
+    serial_port = SerialCommunication(serial_port=ATComport, baud_rate=baud_rate, timeout=timeout, enable_logging=enable_logging)
+
+    # The scheduler owns the AT port, every AT consumer goes through one of its clients
+    scheduler = ATCommandScheduler(serial_port, cache_path=cache_path)
+    InstrumentData["AT_Scheduler_Stats"] = scheduler.stats
+    urcQueue = queue.Queue()
+    scheduler.subscribe_urc("+CEREG", urcQueue.put)
+    scheduler.start()
+    ser_comm_obj = scheduler.client("DUT", PRIORITY_CONTROL)
+    # Share the live AT session with the other tasks
+    if 'AT' in messagesQueue:
+        messagesQueue['AT'].put(scheduler)
+
+    # Reattach the AT channel as soon as the modem is back after a reset
+    if port_watcher is not None:
+        port_watcher.add_listener(lambda modem: scheduler.reattach(modem["ports"]["at"]) if modem else None)
 
     response = ""
 
@@ -37,6 +101,8 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
     if not ATChannelWorking:
         print(f"[DUT_COMM] AT Channel not working. Exiting DUT thread")
         messagesQueue['Display'].put("AT Channel not working")
+        scheduler.stop()
+        serial_port.close_connection()
         return
     
     #-----------------------------------------------
@@ -136,33 +202,38 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
     errorCode,response = ser_comm_obj.send_command_and_wait_for_string("AT+CEREG=2\r\n", response, expected_response="OK")
     print(f"[DUT_COMM] error {errorCode}") if errorCode != 0 else None
 
-    # wait 120 seconds for the modem to register
+    # wait 120 seconds for the modem to register. +CEREG URCs drive the wait,
+    # AT+CEREG? is only sent as a periodic fallback
     start_time = time.time()
+    next_query = start_time
     InstrumentData["Running_Task"] = "Waiting for Network Registration"
+    InstrumentData["Registration_Timeline"] = []
 
     while time.time() - start_time < 120:
-        #--------------------------------------------------------------
-        # This command queries the real time clock (RTC) of the module.
-        #--------------------------------------------------------------
-        errorCode,response = ser_comm_obj.send_command_and_read_response("AT+CEREG?\r\n", response)
-        print(f"[DUT_COMM] error {errorCode}") if errorCode != 0 else None
+        try:
+            response = urcQueue.get(timeout=max(0, next_query - time.time()))
+            query = False
+        except queue.Empty:
+            #--------------------------------------------------------------
+            # This command queries the network registration status.
+            #--------------------------------------------------------------
+            errorCode,response = ser_comm_obj.send_command_and_read_response("AT+CEREG?\r\n", response)
+            print(f"[DUT_COMM] error {errorCode}") if errorCode != 0 else None
+            next_query = time.time() + RegistrationQueryInterval
+            query = True
 
-        # If modem is registered
-        match = re.search(r"\+CEREG: (\d),(\d+),(.+),(.+),(\d+)", response)
-        if match:
-            InstrumentData["cereg_stat"] = int(match.group(2)) if match else -1
-            InstrumentData["cereg_tac"] = str(match.group(3)) if match else None
-            InstrumentData["cereg_ci"] = str(match.group(4)) if match else None
-            InstrumentData["cereg_act"] = int(match.group(5)) if match else -1
-
-        else:
-            # If modem is not registered
-            match = re.search(r"\+CEREG: \d,(\d)", response)
-            if match:
-                InstrumentData["cereg_stat"] = int(match.group(1)) if match else -1
-                InstrumentData["cereg_tac"] = None
-                InstrumentData["cereg_ci"] = None
-                InstrumentData["cereg_act"] = -1
+        cereg = parse_cereg(response, query)
+        if cereg is None:
+            continue
+        InstrumentData["cereg_stat"], InstrumentData["cereg_tac"], InstrumentData["cereg_ci"], InstrumentData["cereg_act"] = cereg
+
+        # Record every change of the registration state
+        if InstrumentData["Current_Reg_Stat"] != InstrumentData["cereg_stat"]:
+            InstrumentData["Registration_Timeline"].append({
+                "t_s": round(time.time() - start_time, 3),
+                "stat": InstrumentData["cereg_stat"],
+                "state": RegistrationStates.get(InstrumentData["cereg_stat"], "unknown"),
+            })
 
         # Write vals in registeration stat
         InstrumentData["Current_Reg_Stat"] = InstrumentData["cereg_stat"]
@@ -183,6 +254,8 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
     if InstrumentData["Current_Reg_Stat"] != 1 and InstrumentData["Current_Reg_Stat"] != 5:
         print(f"[DUT_COMM] Modem not registered. Exiting DUT thread")
         messagesQueue['Display'].put("Unable to register with Network")
+        scheduler.stop()
+        serial_port.close_connection()
         return
 
     
@@ -213,6 +286,10 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
     # Print the JSON string
     print("[DUT_COMM] InstrumentData: " + json_str)
 
+    # Recover the AT channel and the data link on its own from here on
+    watchdog = HealthWatchdog(InstrumentData, scheduler)
+    watchdog.start()
+
     print(f"------------------------------------")
     print(f"\tStart URC Monitoring")
     print(f"------------------------------------")
@@ -222,8 +299,9 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
     #---------------
     while InstrumentData["CloseAllThread"] != "yes":
     
-        response = ser_comm_obj.receive_urc()
-        if response == "":
+        try:
+            response = urcQueue.get(timeout=5)
+        except queue.Empty:
             continue
 
         ChangeDetected = 0
@@ -232,22 +310,9 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
         # Process CEREG URC
         #------------------
 
-        # If modem is registered
-        match = re.search(r"\+CEREG: (\d+),(.+),(.+),(\d+)", response)
-        if match:
-            InstrumentData["cereg_stat"] = int(match.group(1)) if match else -1
-            InstrumentData["cereg_tac"] = str(match.group(2)) if match else None
-            InstrumentData["cereg_ci"] = str(match.group(3)) if match else None
-            InstrumentData["cereg_act"] = int(match.group(4)) if match else -1
-
-        else:
-            # If modem is not registered
-            match = re.search(r"\+CEREG: \d,([0234])", response)
-            if match:
-                InstrumentData["cereg_stat"] = int(match.group(1)) if match else -1
-                InstrumentData["cereg_tac"] = None
-                InstrumentData["cereg_ci"] = None
-                InstrumentData["cereg_act"] = -1
+        cereg = parse_cereg(response)
+        if cereg is not None:
+            InstrumentData["cereg_stat"], InstrumentData["cereg_tac"], InstrumentData["cereg_ci"], InstrumentData["cereg_act"] = cereg
 
         #-----------------------------
         # Process Registeration Events
@@ -256,6 +321,9 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
             # Create Event for change in registeration stat
             InstrumentData["Current_Reg_Stat"] = InstrumentData["cereg_stat"]
             ChangeDetected = 1
+            # Publish it for the coverage accounting of the running test
+            if 'Registration' in messagesQueue:
+                messagesQueue['Registration'].put((time.monotonic(), InstrumentData["cereg_stat"]))
 
             if InstrumentData["cereg_stat"] == 0 or InstrumentData["cereg_stat"] == 2 or InstrumentData["cereg_stat"] == 3 or InstrumentData["cereg_stat"] == 4:
                 InstrumentData["OOC_count"] += 1
@@ -299,7 +367,10 @@ def handle_dut_commands(InstrumentData, ATComport, messagesQueue, baud_rate=9216
             print("[DUT_COMM] InstrumentData: " + json_str)
 
     # Optionally, you can close the connection explicitly
-    ser_comm_obj.close_connection()
+    watchdog.stop()
+    scheduler.stop()
+    serial_port.close_connection()
+    print(f"[DUT_COMM] AT port stats: {scheduler.stats}")
     print(f"[DUT_COMM] Connection closed")
     print(f"[DUT_COMM] Exiting DUT thread")
     return
@@ -0,0 +1,249 @@
+import os
+import re
+import select
+import socket
+import threading
+import time
+
+Module = "[PORT_DISC]"
+
+# USB interface number -> role, shared by the Quectel LTE modules
+QuectelInterfaces = {0: "diag", 1: "nmea", 2: "at", 3: "ppp"}
+
+# (idVendor, idProduct) -> (model, interface roles)
+KnownModems = {
+    ("2c7c", "0125"): ("EC25", QuectelInterfaces),
+    ("2c7c", "0121"): ("EC21", QuectelInterfaces),
+    ("2c7c", "0191"): ("EG91", QuectelInterfaces),
+    ("2c7c", "0195"): ("EG95", QuectelInterfaces),
+    ("2c7c", "0296"): ("BG96", QuectelInterfaces),
+    ("2c7c", "0306"): ("EP06", QuectelInterfaces),
+    ("2c7c", "0512"): ("EM12", QuectelInterfaces),
+    ("2c7c", "0800"): ("RM500Q", QuectelInterfaces),
+    ("05c6", "9215"): ("EC20", QuectelInterfaces),
+}
+
+NETLINK_KOBJECT_UEVENT = 15
+
+
+def read_attribute(directory, name):
+    """
+    Read a sysfs attribute.
+
+    Returns:
+        str: The stripped value, None if the attribute does not exist.
+    """
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def discover_modems(sysfs_root="/sys", dev_root="/dev"):
+    """
+    Find the known modems and the role of each of their USB serial ports.
+
+    Walks <sysfs_root>/bus/usb-serial/devices, resolves every ttyUSB entry to
+    its USB interface (bInterfaceNumber) and USB device (idVendor/idProduct).
+
+    Args:
+        sysfs_root (str): The sysfs mount point. Defaults to "/sys".
+        dev_root (str): The directory of the device nodes. Defaults to "/dev".
+
+    Returns:
+        list: One dict per modem, sorted by USB path:
+            {"usb_path", "vid", "pid", "model", "serial", "devnum", "ports": {"at": "/dev/ttyUSB2", ...}}
+    """
+    devices_dir = os.path.join(sysfs_root, "bus", "usb-serial", "devices")
+    try:
+        entries = sorted(os.listdir(devices_dir))
+    except OSError:
+        return []
+
+    modems = {}
+    for tty in entries:
+        interface_dir = os.path.dirname(os.path.realpath(os.path.join(devices_dir, tty)))
+        usb_dir = os.path.dirname(interface_dir)
+
+        vid = read_attribute(usb_dir, "idVendor")
+        pid = read_attribute(usb_dir, "idProduct")
+        if (vid, pid) not in KnownModems:
+            continue
+
+        number = read_attribute(interface_dir, "bInterfaceNumber")
+        model, roles = KnownModems[(vid, pid)]
+        role = roles.get(int(number, 16)) if number else None
+        if role is None:
+            continue
+
+        usb_path = os.path.basename(usb_dir)
+        modem = modems.setdefault(usb_path, {
+            "usb_path": usb_path,
+            "vid": vid,
+            "pid": pid,
+            "model": model,
+            "serial": read_attribute(usb_dir, "serial"),
+            # devnum changes on every enumeration, so a quick reset is never missed
+            "devnum": read_attribute(usb_dir, "devnum"),
+            "ports": {},
+        })
+        modem["ports"][role] = os.path.join(dev_root, tty)
+
+    return [modems[usb_path] for usb_path in sorted(modems)]
+
+
+def find_modem(usb_path=None, sysfs_root="/sys", dev_root="/dev"):
+    """
+    Find a modem with usable AT and PPP ports.
+
+    Args:
+        usb_path (str): Only accept the modem on this USB path. Defaults to the first modem.
+
+    Returns:
+        dict: The modem, see discover_modems(). None if not found.
+    """
+    for modem in discover_modems(sysfs_root, dev_root):
+        if usb_path is not None and modem["usb_path"] != usb_path:
+            continue
+        # udev creates the device nodes shortly after the kernel reports the ports
+        if all(role in modem["ports"] and os.path.exists(modem["ports"][role]) for role in ("at", "ppp")):
+            return modem
+    return None
+
+
+def wait_for_modem(timeout=90, poll_interval=1.0, usb_path=None, sysfs_root="/sys", dev_root="/dev"):
+    """
+    Wait until a modem has enumerated.
+
+    Args:
+        timeout (float): The time to wait in seconds. Defaults to 90.
+        poll_interval (float): The time between scans in seconds. Defaults to 1.
+
+    Returns:
+        dict: The modem, see discover_modems(). None on timeout.
+    """
+    start_time = time.time()
+    while True:
+        modem = find_modem(usb_path, sysfs_root, dev_root)
+        if modem is not None or time.time() - start_time >= timeout:
+            return modem
+        time.sleep(poll_interval)
+
+
+class PortWatcher:
+    """
+    Follows one modem across USB re-enumeration.
+
+    Kernel uevents (netlink) trigger a rescan of sysfs; when netlink is not
+    available, or a fake sysfs tree is used, sysfs is polled instead. Every
+    time the followed modem disappears or comes back with its ports, the
+    listeners are called with the modem dict (None on removal).
+
+    Args:
+        modem (dict): The modem to follow, see discover_modems().
+        sysfs_root (str): The sysfs mount point. Defaults to "/sys".
+        dev_root (str): The directory of the device nodes. Defaults to "/dev".
+        poll_interval (float): The rescan interval without netlink, and the
+            settle time after a uevent. Defaults to 0.5 s.
+        use_netlink (bool): Whether to listen for kernel uevents. Defaults to True.
+
+    Attributes:
+        current (dict): The followed modem, None while it is not present.
+    """
+    def __init__(self, modem, sysfs_root="/sys", dev_root="/dev", poll_interval=0.5, use_netlink=True):
+        self.usb_path = modem["usb_path"]
+        self.current = modem
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self.poll_interval = poll_interval
+        self.use_netlink = use_netlink and sysfs_root == "/sys"
+        self.listeners = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """
+        Register a callback for changes of the followed modem.
+
+        Args:
+            callback (callable): Called with the modem dict, or None when it was removed.
+        """
+        self.listeners.append(callback)
+
+    def start(self):
+        """
+        Start watching in a background thread.
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _open_netlink(self):
+        if not self.use_netlink:
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))
+            return sock
+        except (AttributeError, OSError) as e:
+            print(f"{Module} No uevent socket ({e}), polling sysfs")
+            return None
+
+    def _run(self):
+        sock = self._open_netlink()
+        try:
+            while not self._stop_event.is_set():
+                if sock is None:
+                    self._stop_event.wait(self.poll_interval)
+                    self.rescan()
+                    continue
+
+                readable, _, _ = select.select([sock], [], [], 1.0)
+                if not readable:
+                    # Catches an udev node that appeared after the last uevent
+                    if self.current is None:
+                        self.rescan()
+                    continue
+                if self._is_serial_event(sock.recv(65536)):
+                    # Let the burst of events for all interfaces settle
+                    self._stop_event.wait(self.poll_interval)
+                    self._drain(sock)
+                    self.rescan()
+        finally:
+            if sock is not None:
+                sock.close()
+
+    @staticmethod
+    def _is_serial_event(message):
+        return re.search(rb"ttyUSB|usb-serial|SUBSYSTEM=usb\x00", message) is not None
+
+    @staticmethod
+    def _drain(sock):
+        while select.select([sock], [], [], 0)[0]:
+            sock.recv(65536)
+
+    def rescan(self):
+        """
+        Rescan sysfs and notify the listeners if the followed modem changed.
+        """
+        modem = find_modem(self.usb_path, self.sysfs_root, self.dev_root)
+        if modem == self.current:
+            return
+
+        if modem is None:
+            print(f"{Module} Modem on USB {self.usb_path} removed")
+        else:
+            print(f"{Module} Modem on USB {self.usb_path} attached: {modem['ports']}")
+        self.current = modem
+        for callback in self.listeners:
+            callback(modem)
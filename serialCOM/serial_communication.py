@@ -84,6 +84,53 @@ class SerialCommunication:
             print("[ERROR] Serial port error")
         return response
     
+    def write_command(self, command):
+        """
+        Writes a command to the serial port without waiting for the response.
+
+        Args:
+            command (str): The command to send.
+
+        Returns:
+            int: An error code. 0 if successful, -1 otherwise.
+        """
+        error_code = -1
+        try:
+            if self.ser and self.ser.is_open:
+                if self.enable_logging:
+                    print(self.get_formatted_time(), command)
+                self.ser.write(command.encode())
+                error_code = 0
+        except serial.SerialException as e:
+            if self.enable_logging:
+                print(f"Serial port error: {e}")
+
+        return error_code
+
+    def read_line(self, timeout=1):
+        """
+        Reads one line (or whatever arrived before the timeout) from the serial port.
+
+        Args:
+            timeout (float): The time to wait for the line. Defaults to 1 second.
+
+        Returns:
+            int: An error code. 0 if successful, -1 otherwise.
+            str: The data read, may be a partial line or empty on timeout
+        """
+        error_code = -1
+        line = ""
+        try:
+            if self.ser and self.ser.is_open:
+                self.ser.timeout = timeout
+                line = self.ser.readline().decode(errors="replace")
+                error_code = 0
+        except serial.SerialException as e:
+            if self.enable_logging:
+                print(f"Serial port error: {e}")
+
+        return error_code,line
+
     def send_command_and_read_response(self, command, response, timeout=5):
         """
         Sends a command and reads the response from the serial port.